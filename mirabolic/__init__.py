@@ -1,11 +1,35 @@
+import importlib
 import os
 
 with open(os.path.join(os.path.dirname(__file__), "version"), mode="r") as fp:
     __version__ = fp.readline().rstrip()
 
-# We import some functions/classes for ease of reference.
-from mirabolic.cdf.cdf_tools import cdf_plot
-from mirabolic.cdf.qq_plot import qq_plot
-from mirabolic.rates.rate_tools import rate_comparison
-from mirabolic.llm_embeddings.llm_embedder import llm_embedder
-from mirabolic.llm_embeddings.llm_tools import LLM_API
+# We make some functions/classes available for ease of reference.  They
+# are only imported on first use: the LLM tools, for instance, need
+# several large libraries that users of (say) cdf_plot() never touch.
+lazy_attributes = dict(
+    cdf_plot="mirabolic.cdf.cdf_tools",
+    cdf_bands="mirabolic.cdf.batch",
+    qq_plot="mirabolic.cdf.qq_plot",
+    rate_comparison="mirabolic.rates.rate_tools",
+    rate_monitor="mirabolic.rates.rate_monitor",
+    llm_embedder="mirabolic.llm_embeddings.llm_embedder",
+    LLM_API="mirabolic.llm_embeddings.llm_tools",
+)
+subpackages = {"cdf", "rates", "llm_embeddings", "neural_glm"}
+
+
+def __getattr__(name):
+    if name in lazy_attributes:
+        value = getattr(importlib.import_module(lazy_attributes[name]), name)
+    elif name in subpackages:
+        value = importlib.import_module(f"{__name__}.{name}")
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    # Later lookups find it directly
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(lazy_attributes) | subpackages)
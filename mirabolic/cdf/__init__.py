@@ -0,0 +1,14 @@
+# CDFs with confidence bands, and the tools behind them
+from mirabolic.cdf.cdf_tools import (
+    cdf_plot,
+    confidence_band,
+    shortest_beta_interval,
+)
+from mirabolic.cdf.chunked import cdf_plot_chunked
+from mirabolic.cdf.batch import cdf_bands
+from mirabolic.cdf.compare import compare_distributions
+from mirabolic.cdf.reference import cdf_reference
+from mirabolic.cdf.incremental import incremental_ecdf
+from mirabolic.cdf.bootstrap import bootstrap_cdf_band, bootstrap_qq_band
+from mirabolic.cdf.band_cache import configure_band_cache, get_band_cache
+from mirabolic.cdf.quantile_sketch import kll_sketch
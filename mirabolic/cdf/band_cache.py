@@ -0,0 +1,267 @@
+# A cache for CDF confidence bands.
+#
+# The confidence band around a CDF depends only on the ranks we plot,
+# the number of data points N, the confidence level, the bound and the
+# ecdf_type; it never depends on the data values themselves.  So, if we
+# plot many data sets of the same size, we can compute the band once
+# and look it up thereafter.
+#
+# We keep an in-process LRU cache of bands (bounded both in keys and in
+# bytes, since a band over every rank of a large N can be big),
+# optionally backed by an on-disk table, so that the work survives
+# between processes.  On disk, each key has a base .npz file, plus one
+# small .npz file for each batch of ranks added since; we only write the
+# new ranks, and fold the batches into the base file once there are
+# MAX_DISK_CHUNKS of them.  The table can be prewarmed for common values
+# of N.
+
+import os
+import glob
+import hashlib
+import uuid
+from collections import OrderedDict
+import numpy as np
+
+from mirabolic.cdf.cdf_tools import (
+    confidence_band_with_error,
+    plot_index_list,
+    ASYMPTOTIC_TOL,
+)
+
+
+def stable_hash(s, out_bytes=10):
+    # The intrinsic Python "hash" function is constant across a single process but
+    # varies between processes. This function tries to give us a more stable
+    # hash value.
+    m = hashlib.sha256()
+    m.update(str(s).encode("utf-8"))
+    return m.hexdigest()[:out_bytes]
+
+
+# Batches of ranks stored on disk (per key) before we merge them
+MAX_DISK_CHUNKS = 16
+FIELDS = ["a", "lower", "upper", "error"]
+
+
+def entry_bytes(entry):
+    return sum(entry[k].nbytes for k in FIELDS)
+
+
+def merge_entries(entries):
+    # One entry with the ranks of all of them (each rank once), sorted
+    a = np.concatenate([e["a"] for e in entries])
+    a, first = np.unique(a, return_index=True)
+    merged = {k: np.concatenate([e[k] for e in entries])[first] for k in FIELDS[1:]}
+    merged["a"] = a
+    return merged
+
+
+def save_atomically(path, entry):
+    # Write to a temporary file first, so that other processes sharing
+    # cache_dir never see a partially written table.
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **entry)
+    os.replace(tmp_path, path)
+
+
+class band_cache:
+    def __init__(self, maxsize=128, cache_dir=None, max_bytes=2**26):
+        """
+        Cache confidence bands, keyed by (N, confidence, bound, ecdf_type,
+        asymptotic_tol).
+        We keep up to "maxsize" keys, taking up to "max_bytes" (or without
+        limit, if None), in memory; if "cache_dir" is given, we also store
+        every band on disk.
+        """
+        assert maxsize >= 1
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # The on-disk batches of ranks of each key we know of
+        self.chunks = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def band(self, **kwargs):
+        """
+        Return arrays (lower, upper) of the confidence band at ranks "a";
+        see cdf_tools.confidence_band().  Only ranks we haven't seen
+        before are computed.
+        """
+        lower, upper, error_estimate = self.band_with_error(**kwargs)
+        return (lower, upper)
+
+    def band_with_error(
+        self,
+        a=None,
+        N=None,
+        confidence=None,
+        bound=None,
+        ecdf_type=None,
+        asymptotic_tol=ASYMPTOTIC_TOL,
+    ):
+        """
+        Like band(), but also return the estimated error of each rank's
+        bounds; see cdf_tools.confidence_band_with_error().
+        """
+        a = np.asarray(a)
+        key = (int(N), float(confidence), bound, ecdf_type, asymptotic_tol)
+        entry = self.get_entry(key)
+
+        pos = np.searchsorted(entry["a"], a)
+        found = pos < len(entry["a"])
+        found[found] = entry["a"][pos[found]] == a[found]
+        if found.all():
+            self.hits += 1
+        else:
+            self.misses += 1
+            missing = np.unique(a[~found])
+            lower, upper, error = confidence_band_with_error(
+                a=missing,
+                N=N,
+                confidence=confidence,
+                bound=bound,
+                ecdf_type=ecdf_type,
+                asymptotic_tol=asymptotic_tol,
+            )
+            entry = self.add_to_entry(key, entry, missing, lower, upper, error)
+            pos = np.searchsorted(entry["a"], a)
+
+        return (entry["lower"][pos], entry["upper"][pos], entry["error"][pos])
+
+    def prewarm(
+        self,
+        N_list=None,
+        confidence=0.9,
+        bound="marginal_opt",
+        ecdf_type=None,
+        max_points=128,
+        asymptotic_tol=ASYMPTOTIC_TOL,
+    ):
+        """
+        Compute (and store) the bands that cdf_plot() would use for each
+        sample size in N_list.
+        """
+        for N in N_list:
+            if N < 2:
+                # cdf_plot() special-cases N==1
+                continue
+            a = plot_index_list(N, max_points) + 1
+            self.band(
+                a=a,
+                N=N,
+                confidence=confidence,
+                bound=bound,
+                ecdf_type=ecdf_type,
+                asymptotic_tol=asymptotic_tol,
+            )
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        empty = np.zeros(0)
+        entries = [
+            dict(a=np.zeros(0, dtype=int), lower=empty, upper=empty, error=empty)
+        ]
+        if self.cache_dir is not None:
+            # The base file, and any batches added since (by any process)
+            chunks = []
+            for path in self.disk_paths(key):
+                try:
+                    with np.load(path) as blob:
+                        entries.append({k: blob[k] for k in FIELDS})
+                except FileNotFoundError:
+                    # Merged into the base file by another process
+                    continue
+                if path != self.path(key):
+                    chunks.append(path)
+            self.chunks[key] = chunks
+        entry = merge_entries(entries)
+        self.store(key, entry)
+        return entry
+
+    def add_to_entry(self, key, entry, a, lower, upper, error):
+        new = dict(a=a, lower=lower, upper=upper, error=error)
+        entry = merge_entries([entry, new])
+        self.store(key, entry)
+
+        if self.cache_dir is not None:
+            chunks = self.chunks.setdefault(key, [])
+            if len(chunks) + 1 < MAX_DISK_CHUNKS:
+                # Only write the new ranks
+                path = f"{self.path(key)[:-4]}.{uuid.uuid4().hex[:12]}.npz"
+                save_atomically(path, new)
+                chunks.append(path)
+            else:
+                # Fold everything we have into the base file
+                save_atomically(self.path(key), entry)
+                for path in chunks:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                chunks.clear()
+
+        return entry
+
+    def store(self, key, entry):
+        if key in self.entries:
+            self.total_bytes -= entry_bytes(self.entries[key])
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.total_bytes += entry_bytes(entry)
+        # (If one band is bigger than max_bytes, we don't keep it at all.)
+        while len(self.entries) > self.maxsize or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        ):
+            old_key, old_entry = self.entries.popitem(last=False)
+            self.total_bytes -= entry_bytes(old_entry)
+
+    def path(self, key):
+        # The base file of a key; batches of ranks added since go in
+        # "band_<hash>.<id>.npz"
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"band_{stable_hash(key)}.npz")
+
+    def disk_paths(self, key):
+        prefix = self.path(key)[:-4]
+        paths = [p for p in glob.glob(f"{prefix}.*.npz") if not p.endswith(".tmp.npz")]
+        if os.path.exists(self.path(key)):
+            paths.insert(0, self.path(key))
+        return paths
+
+
+# The cache used by cdf_plot(use_cache=True)
+default_band_cache = None
+
+
+def get_band_cache():
+    global default_band_cache
+    if default_band_cache is None:
+        default_band_cache = band_cache()
+    return default_band_cache
+
+
+def configure_band_cache(maxsize=128, cache_dir=None, max_bytes=2**26):
+    """
+    Replace the cache used by cdf_plot(), e.g., to add an on-disk table
+    shared between processes.
+    """
+    global default_band_cache
+    default_band_cache = band_cache(
+        maxsize=maxsize, cache_dir=cache_dir, max_bytes=max_bytes
+    )
+    return default_band_cache
@@ -0,0 +1,103 @@
+# CDFs (with confidence bands) for many columns or groups at once.
+#
+# When we draw a CDF for every segment of a data set, calling cdf_plot()
+# in a loop redoes the band computation for every segment, even though
+# the band depends only on the segment's size N (and not on the data
+# values).  Here we compute the band once per distinct N and share it,
+# and find each segment's order statistics in a pool of threads (NumPy
+# releases the GIL while sorting and partitioning, so the threads run
+# in parallel).
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from mirabolic.cdf.cdf_tools import (
+    clean_data,
+    compute_cdf_band,
+    order_statistics,
+    plot_index_list,
+    ASYMPTOTIC_TOL,
+)
+
+
+def cdf_bands(
+    # Key arguments
+    frame=None,  # A PANDAS DataFrame
+    by=None,  # Column(s) to group by, as in frame.groupby(by)
+    columns=None,  # Columns to compute CDFs of (by default, all numeric columns)
+    confidence=0.9,
+    # Statistical and control parameters
+    selection="auto",
+    bound="marginal_opt",
+    ecdf_type=None,
+    max_points=128,
+    use_cache=True,
+    asymptotic_tol=ASYMPTOTIC_TOL,
+    n_jobs=None,  # How many threads to use (by default, one per core)
+):
+    """
+    Compute the CDF and confidence band of each column of "frame" (and,
+    if "by" is given, of each group), without plotting them.  Returns a
+    dict mapping each column name (or (group, column) pair) to the same
+    results as cdf_plot(), which can be drawn with plot_cdf_band().
+    """
+    # Check input arguments
+    assert confidence >= 0 and confidence <= 1
+    assert bound in {"marginal_quick", "marginal_opt", "simultaneous", "DKW"}
+    assert ecdf_type in {"classical", "mode", "mean", None}
+
+    if by is None:
+        groups = [(None, frame)]
+    else:
+        groups = list(frame.groupby(by))
+    if columns is None:
+        excluded = set(np.atleast_1d(by)) if by is not None else set()
+        numeric = frame.select_dtypes("number").columns
+        columns = [c for c in numeric if c not in excluded]
+    if isinstance(columns, str):
+        columns = [columns]
+
+    segments = []
+    for group, group_frame in groups:
+        for column in columns:
+            key = column if by is None else (group, column)
+            segments.append((key, group_frame[column]))
+
+    def select(segment):
+        key, data = segment
+        data, owns_data = clean_data(data)
+        N = len(data)
+        index_list = plot_index_list(N, max_points)
+        x = order_statistics(
+            data, index_list, method=selection, overwrite_data=owns_data
+        )
+        return (key, N, index_list, x)
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        selected = list(pool.map(select, segments))
+
+    # One band per distinct N, computed once for every segment of that
+    # size (each segment gets its own copy of the arrays, which are at
+    # most max_points long, so changing one result leaves the others be)
+    bands = {}
+    results = {}
+    for key, N, index_list, x in selected:
+        if N not in bands:
+            bands[N] = compute_cdf_band(
+                x=None,
+                index_list=index_list,
+                N=N,
+                confidence=confidence,
+                bound=bound,
+                ecdf_type=ecdf_type,
+                use_cache=use_cache,
+                asymptotic_tol=asymptotic_tol,
+            )
+        results[key] = {
+            k: v.copy() if isinstance(v, np.ndarray) else v for k, v in bands[N].items()
+        }
+        results[key]["x"] = x
+    return results
@@ -0,0 +1,311 @@
+# Bootstrap confidence bands for CDFs and Q-Q plots.
+#
+# The beta bands of cdf_tools.py assume independent, unweighted data.
+# For dependent data (e.g., a time series) or data with sampling weights,
+# we can instead resample the data many times and see how much the ECDF
+# (or the quantiles) move.  We never build the resampled data sets:
+#
+#  - For independent data without weights, the ECDF of a resample at our
+#    grid points only depends on how many resampled points fall between
+#    them, which is multinomial.  Likewise, the k-th smallest resampled
+#    value is sorted_data[floor(N*U)], where U is the k-th smallest of N
+#    uniforms, which we draw as gamma partial sums (as in
+#    simultaneous.py).  Either way, the cost doesn't depend on N.
+#  - Otherwise, we draw how many times each point occurs in each
+#    resample, a block of resamples at a time (to bound memory).  For
+#    dependent data, we resample runs of block_length consecutive points
+#    (the "moving block" bootstrap), which keeps short-range dependence
+#    intact.
+#
+# Resamples are split into tasks of RESAMPLES_PER_TASK, each with its own
+# random stream (spawned from "seed"), and (if asked, with n_jobs > 1)
+# spread across processes.  The results only depend on the seed, not on
+# how many processes we use.  We don't start processes by default: they
+# need the caller's script to be importable (with an 'if __name__ ==
+# "__main__"' guard), and can't be started from inside another pool's
+# worker.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from mirabolic.cdf.cdf_tools import (
+    clean_data,
+    clean_weights,
+    plot_index_list,
+    weighted_order_statistics,
+)
+
+# Most numbers we draw at once (per process)
+BATCH_SIZE = 2**22
+# Resamples per random stream
+RESAMPLES_PER_TASK = 100
+# Numbers drawn worth starting a process for
+MIN_WORK_PER_PROCESS = 2**22
+
+
+def bootstrap_cdf_band(
+    data=None,
+    counts=None,  # If given, data[i] occurs counts[i] times
+    weights=None,  # If given, data[i] has (sampling) weight weights[i]
+    confidence=0.9,
+    num_resamples=1000,
+    block_length=None,  # Resample runs of this many points (dependent data)
+    max_points=128,
+    seed=0,
+    n_jobs=1,
+):
+    """
+    Compute the CDF of "data" with a bootstrap confidence band: at each
+    plotted point, the central "confidence" interval of the ECDF over
+    num_resamples resamples.  Returns a "results" dict like that of
+    cdf_plot(), which can be drawn with plot_cdf_band().  Resamples are
+    spread across n_jobs processes (n_jobs=None means one per core).
+    """
+    assert confidence >= 0 and confidence <= 1
+    sample = bootstrap_sample(data, counts, weights, block_length)
+    N = sample["N"]
+    index_list = plot_index_list(N, max_points)
+    x = sample_order_statistics(sample, index_list)
+    # The last (sorted) value <= each x
+    target = np.searchsorted(sample["values"], x, side="right") - 1
+
+    y = ecdf_at(sample, target)
+    F = run_resamples(sample, "cdf", target, num_resamples, seed, n_jobs)
+    tail = (1 - confidence) / 2
+    y_lower, y_upper = np.quantile(F, [tail, 1 - tail], axis=0)
+
+    results = dict(
+        x=x,
+        y=y,
+        y_lower=y_lower,
+        y_upper=y_upper,
+        index_list=index_list,
+        DKW_epsilon_bound=None,
+        sketch_rank_error=None,
+        band_method="bootstrap",
+        band_error_estimate=None,
+    )
+    return results
+
+
+def bootstrap_qq_band(
+    x=None,
+    y=None,
+    N=300,  # How many quantiles? (As in qq_plot())
+    x_counts=None,
+    y_counts=None,
+    x_weights=None,
+    y_weights=None,
+    confidence=0.9,
+    num_resamples=1000,
+    block_length=None,
+    seed=0,
+    n_jobs=1,
+):
+    """
+    Compute the matched quantiles of qq_plot(), with bootstrap confidence
+    intervals on each quantile of x and of y.  Returns (x_q, y_q,
+    envelope), as qq_plot(envelope=True) does.
+    """
+    assert confidence >= 0 and confidence <= 1
+    x_sample = bootstrap_sample(x, x_counts, x_weights, block_length)
+    y_sample = bootstrap_sample(y, y_counts, y_weights, block_length)
+    if x_sample["N"] == y_sample["N"]:
+        # As in qq_plot()
+        N = min(N, x_sample["N"])
+    q = np.linspace(0, 1, N)
+
+    tail = (1 - confidence) / 2
+    envelope = {}
+    quantiles = []
+    x_seed, y_seed = np.random.SeedSequence(seed).spawn(2)
+    for name, sample, sample_seed in [("x", x_sample, x_seed), ("y", y_sample, y_seed)]:
+        position = q * (sample["N"] - 1)
+        ranks = np.unique(np.r_[np.floor(position), np.ceil(position)]).astype(int)
+        values = sample_order_statistics(sample, ranks)
+        quantiles.append(interpolate_rows(ranks, values[None, :], position)[0])
+        Q = run_resamples(sample, "quantile", ranks, num_resamples, sample_seed, n_jobs)
+        Q = interpolate_rows(ranks, Q, position)
+        envelope[f"{name}_lower"], envelope[f"{name}_upper"] = np.quantile(
+            Q, [tail, 1 - tail], axis=0
+        )
+    return (quantiles[0], quantiles[1], envelope)
+
+
+def bootstrap_sample(data, counts, weights, block_length):
+    # Everything the resampling needs to know about the data: the sorted
+    # values, their counts or weights (if any), the order that sorts
+    # them (for blocks), and N (as in cdf_plot()).
+    assert block_length is None or block_length >= 1
+    if counts is None and weights is None:
+        data, is_copy = clean_data(data)
+        w, N = None, len(data)
+    else:
+        # Counts stand for ties, so have no order to keep in blocks
+        assert block_length is None or counts is None
+        data, w, N = clean_weights(data, counts=counts, weights=weights)
+    # Only blocks need to know where each sorted value came from
+    order = None
+    if block_length is not None:
+        block_length = min(block_length, len(data))
+        order = np.argsort(data, kind="stable")
+        values, w = data[order], None if w is None else w[order]
+    elif w is None:
+        values = np.sort(data)
+    else:
+        sort = np.argsort(data, kind="stable")
+        values, w = data[sort], w[sort]
+    return dict(
+        values=values,
+        w=w,
+        is_counts=counts is not None,
+        order=order,
+        N=N,
+        block_length=block_length,
+    )
+
+
+def is_independent(sample):
+    # Can we take the shortcuts for independent, unweighted data?
+    return sample["block_length"] is None and (
+        sample["w"] is None or sample["is_counts"]
+    )
+
+
+def sample_order_statistics(sample, ranks):
+    # sorted(data)[ranks], with data expanded by its counts or weights
+    if sample["w"] is None:
+        return sample["values"][ranks]
+    return weighted_order_statistics(sample["values"], sample["w"], ranks, sample["N"])
+
+
+def ecdf_at(sample, target):
+    # The fraction of the data at (sorted) positions <= target
+    w = sample["w"]
+    if w is None:
+        return (target + 1) / len(sample["values"])
+    cumulative = np.cumsum(w)
+    return cumulative[target] / cumulative[-1]
+
+
+def run_resamples(sample, statistic, target, num_resamples, seed, n_jobs):
+    # Evaluate "statistic" at "target" on num_resamples resamples, one row
+    # per resample.
+    num_tasks = max(1, -(-num_resamples // RESAMPLES_PER_TASK))
+    tasks = [len(s) for s in np.array_split(np.arange(num_resamples), num_tasks)]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(num_tasks)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    # Not worth starting processes for small problems
+    cost = len(target) if is_independent(sample) else len(sample["values"])
+    n_jobs = max(
+        1, min(n_jobs, num_tasks, num_resamples * cost // MIN_WORK_PER_PROCESS)
+    )
+    args = ([sample] * num_tasks, [statistic] * num_tasks, [target] * num_tasks)
+    args = args + (tasks, seeds)
+    if n_jobs == 1:
+        parts = map(resample_statistics, *args)
+        return np.concatenate(list(parts))
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return np.concatenate(list(pool.map(resample_statistics, *args)))
+
+
+def resample_statistics(sample, statistic, target, num_resamples, seed):
+    # For "cdf", the ECDF of each resample at (sorted) positions "target";
+    # for "quantile", the order statistics at ranks "target".
+    rng = np.random.default_rng(seed)
+    m = len(sample["values"])
+    if is_independent(sample):
+        batch = max(1, BATCH_SIZE // (len(target) + 1))
+    else:
+        batch = max(1, BATCH_SIZE // m)
+    results = []
+    for start in range(0, num_resamples, batch):
+        size = min(batch, num_resamples - start)
+        if not is_independent(sample):
+            results.append(weighted_statistics(sample, statistic, target, rng, size))
+        elif statistic == "cdf":
+            results.append(independent_ecdf(sample, target, rng, size))
+        else:
+            results.append(independent_order_statistics(sample, target, rng, size))
+    return np.concatenate(results)
+
+
+def independent_ecdf(sample, target, rng, size):
+    # The resampled points between consecutive targets are multinomial
+    N = sample["N"]
+    cumulative = np.r_[0, ecdf_at(sample, target), 1]
+    p = np.maximum(np.diff(cumulative), 0)
+    counts = rng.multinomial(N, p / p.sum(), size=size)
+    return np.cumsum(counts[:, :-1], axis=1) / N
+
+
+def independent_order_statistics(sample, ranks, rng, size):
+    # The (0-based) rank k of a resample is the expanded data at position
+    # floor(N*U), for U the (k+1)-th smallest of N uniforms.
+    N = sample["N"]
+    shape = np.diff(np.r_[0, ranks + 1, N + 1])
+    sums = np.cumsum(rng.standard_gamma(shape, size=(size, len(shape))), axis=1)
+    position = np.floor(N * sums[:, :-1] / sums[:, -1:]).astype(int)
+    position = np.minimum(position, N - 1)
+    if sample["w"] is None:
+        return sample["values"][position]
+    # Expand counts (the only weights allowed here)
+    cumulative = np.cumsum(sample["w"])
+    return sample["values"][np.searchsorted(cumulative, position, side="right")]
+
+
+def resample_counts(m, block_length, rng, size):
+    # How many times each of m points (in their original order) occurs in
+    # each resample
+    if block_length is None:
+        num_starts, num_runs, block_length = m, m, 1
+    else:
+        num_starts = m - block_length + 1
+        num_runs = -(-m // block_length)
+    # Draw the starts of the runs, and count them (all rows at once, by
+    # giving each row its own range of bins)
+    starts = rng.integers(num_starts, size=(size, num_runs))
+    starts += num_starts * np.arange(size)[:, None]
+    starts = np.bincount(starts.ravel(), minlength=size * num_starts)
+    if block_length == 1:
+        return starts.reshape(size, m)
+    # Point i is covered by runs starting in [i - block_length + 1, i]
+    cumulative = np.c_[np.zeros(size, dtype=int), starts.reshape(size, -1).cumsum(1)]
+    i = np.arange(m)
+    last = np.minimum(i + 1, num_starts)
+    first = np.maximum(i - block_length + 1, 0)
+    return cumulative[:, last] - cumulative[:, first]
+
+
+def weighted_statistics(sample, statistic, target, rng, size):
+    # Resample the points themselves (each keeping its weight)
+    values, w, N = sample["values"], sample["w"], sample["N"]
+    counts = resample_counts(len(values), sample["block_length"], rng, size)
+    mass = counts if sample["order"] is None else counts[:, sample["order"]]
+    if w is not None:
+        mass = mass * w
+    cumulative = np.cumsum(mass, axis=1)
+    total = cumulative[:, -1:]
+    if statistic == "cdf":
+        return cumulative[:, target] / total
+    # Find the ranks in each row at once: shifting row j by j*(N+1) makes
+    # the whole (scaled) table one increasing sequence.
+    shift = (N + 1) * np.arange(size)[:, None]
+    scaled = (cumulative * (N / total) + shift).ravel()
+    position = np.searchsorted(scaled, (target[None, :] + shift).ravel(), side="right")
+    position = (
+        position.reshape(size, len(target)) - len(values) * np.arange(size)[:, None]
+    )
+    return values[np.minimum(position, len(values) - 1)]
+
+
+def interpolate_rows(ranks, values, position):
+    # As qq_plot.interpolate_positions(), for each row of "values"
+    low = np.floor(position)
+    x_low = values[:, np.searchsorted(ranks, low)]
+    x_high = values[:, np.searchsorted(ranks, np.ceil(position))]
+    return x_low + (position - low) * (x_high - x_low)
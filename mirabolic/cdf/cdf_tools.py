@@ -2,13 +2,12 @@
 # for the corresponding CDF.
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-import pandas as pd
-from scipy.stats import binom, beta
-from scipy.special import loggamma
+from scipy.stats import binom, beta, norm
+from scipy.special import betaln
 from scipy import interpolate
 
+from mirabolic.cdf.quantile_sketch import kll_sketch
+
 # The beta distribution is the correct (pointwise) distribution
 # across *quantiles* for a given *data point*; if you're not
 # sure, this is probably the estimator you want to use.
@@ -42,66 +41,213 @@ def cdf_CI_marginal_quick(a=None, N=None, confidence=None, **kwargs):
     return (lower, upper)
 
 
-def cdf_CI_marginal_opt(a=None, N=None, confidence=None, max_steps=6, **kwargs):
-    # The marginal distribution is beta-distributed, and this calculates a
-    # (marginal) confidence interval exactly.  There are different choices
-    # for the confidence interval.  If N>1, then there is a unique shortest
-    # confidence interval; because the beta distribution is (usually)
-    # asymmetric, computing this interval requires a little work.  (We use
-    # Newton's method to optimize.)
+def shortest_beta_interval(a=None, b=None, confidence=None, max_steps=50, xtol=1e-12):
+    """
+    Find the shortest interval containing probability "confidence" under
+    the beta(a, b) distribution.  The parameters a, b >= 1 may be arrays,
+    in which case we solve for every interval at once.  Returns arrays
+    (lower, upper).
+    """
+    # For a unimodal density, the shortest interval [l, u] is the one
+    # whose endpoints have equal density, so we solve
+    #
+    #   G1 = cdf(u) - cdf(l) - confidence = 0
+    #   G2 = log pdf(l) - log pdf(u)      = 0
+    #
+    # with Newton's method in (l, u).  The Jacobian has a closed form,
+    # since d/dx log pdf(x) = g(x) = (a-1)/x - (b-1)/(1-x), so each step
+    # costs two beta.cdf calls (over the ranks still being solved): no
+    # finite differences, and no calls to the expensive beta.ppf.
+    shape = np.broadcast(a, b).shape
+    a = np.broadcast_to(np.asarray(a, dtype=float), shape).ravel()
+    b = np.broadcast_to(np.asarray(b, dtype=float), shape).ravel()
+    lower = np.zeros(a.shape)
+    upper = np.ones(a.shape)
 
-    b = N + 1 - a
+    # If a==1 (or b==1) the density is monotone, so the shortest
+    # interval starts at 0 (or ends at 1).
+    left = a == 1
+    right = (b == 1) & ~left
+    upper[left] = beta.ppf(confidence, a[left], b[left])
+    lower[right] = beta.ppf(1 - confidence, a[right], b[right])
 
-    if a == 1:
-        lower = 0
-        upper = beta.ppf(confidence, a, b)
-        return (lower, upper)
-    if a == N:
-        lower = beta.ppf(1 - confidence, a, b)
-        upper = 1
-        return (lower, upper)
+    interior = np.flatnonzero(~left & ~right)
+    if len(interior) == 0:
+        return (lower.reshape(shape), upper.reshape(shape))
+    a, b = a[interior], b[interior]
 
-    # Choose a reasonable starting guess
-    lower, upper = cdf_CI_marginal_quick(a=a, N=N, confidence=confidence, **kwargs)
-
-    # We want a relatively small step size in the context of our
-    # distribution
-    delta = min(0.1 / (N ** 2), 0.0001)
-
-    B_norm = np.exp(loggamma(a + b) - loggamma(a) - loggamma(b))
-
-    # lower_guess should always be in [0, max_lower_guess]
-    max_lower = beta.ppf(1 - confidence, a, b)
-
-    def recover_upper(lower):
-        prob = min(beta.cdf(lower, a, b) + confidence, 1.0)
-        return beta.ppf(prob, a, b)
-
-    def f_0(lower):
-        # f_0 should be monotonically increasing for a,b>=2
-        upper = recover_upper(lower)
-        b_lower = beta.pdf(lower, a, b)
-        b_upper = beta.pdf(upper, a, b)
-        return b_lower - b_upper
-
-    def f_1(lower, f_left=None):
-        if f_left is None:
-            f_left = f_0(lower)
-        f_right = f_0(lower + delta)
-        return (f_right - f_left) / delta
-
-    for step_count in range(max_steps):
-        f_0_val = f_0(lower)
-        f_1_val = f_1(lower, f_left=f_0_val)
-        step_size = f_0_val / f_1_val
-        lower = lower - step_size
-        # delta = min(delta, np.abs(step) / 100)
-        if np.abs(step_size) < delta:
-            break
+    # Starting guess.  When a and b are both large the beta distribution
+    # is nearly normal, and we start from a normal interval, shifted
+    # and bent by the skewness (a first-order Cornish-Fisher expansion).
+    # Otherwise, we start from the "quick" interval (see
+    # cdf_CI_marginal_quick), which costs two beta.ppf calls.
+    # (Degenerate parameters, such as b == 0 when successes == trials,
+    # give NaN intervals, without warnings.)
+    n = a + b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sd = np.sqrt(a * b / (n**2 * (n + 1)))
+        skew = 2 * (b - a) * np.sqrt(n + 1) / ((n + 2) * np.sqrt(a * b))
+        z = norm.ppf((1 + confidence) / 2)
+        z_l = -z - skew / 3
+        z_u = z - skew / 3
+        l = a / n + sd * (z_l + skew / 6 * (z_l**2 - 1))
+        u = a / n + sd * (z_u + skew / 6 * (z_u**2 - 1))
+    slow_start = (np.minimum(a, b) < 30) | ~((0 < l) & (l < u) & (u < 1))
+    if slow_start.any():
+        a_s, b_s = a[slow_start], b[slow_start]
+        mode = (a_s - 1) / (a_s + b_s - 2)
+        lower_prob = beta.cdf(mode, a_s, b_s) * (1 - confidence)
+        l[slow_start] = beta.ppf(lower_prob, a_s, b_s)
+        u[slow_start] = beta.ppf(lower_prob + confidence, a_s, b_s)
 
-    upper = recover_upper(lower)
+    log_B = betaln(a, b)
+    last_step = np.full(a.shape, np.inf)
+    active = np.arange(len(a))
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for step_count in range(max_steps):
+            aa, bb, ll, uu = a[active], b[active], l[active], u[active]
+            if confidence > 0.5:
+                # Work with the tails, which is more accurate here
+                G1 = (1 - confidence) - beta.sf(uu, aa, bb) - beta.cdf(ll, aa, bb)
+            else:
+                G1 = beta.cdf(uu, aa, bb) - beta.cdf(ll, aa, bb) - confidence
+            log_pl = (aa - 1) * np.log(ll) + (bb - 1) * np.log1p(-ll) - log_B[active]
+            log_pu = (aa - 1) * np.log(uu) + (bb - 1) * np.log1p(-uu) - log_B[active]
+            G2 = log_pl - log_pu
+            pl, pu = np.exp(log_pl), np.exp(log_pu)
+            gl = (aa - 1) / ll - (bb - 1) / (1 - ll)
+            gu = (aa - 1) / uu - (bb - 1) / (1 - uu)
+            det = pl * gu - pu * gl
+            dl = (G1 * gu + pu * G2) / det
+            du = (pl * G2 + G1 * gl) / det
 
-    return (lower, upper)
+            # Damp any steps which would leave 0 < l < u < 1
+            t = np.ones(len(active))
+            for halving in range(60):
+                new_l, new_u = ll + t * dl, uu + t * du
+                outside = ~((0 < new_l) & (new_l < new_u) & (new_u < 1))
+                if not outside.any():
+                    break
+                t[outside] /= 2
+            l[active] = np.where(outside, ll, new_l)
+            u[active] = np.where(outside, uu, new_u)
+
+            # Ranks that have converged (or are no longer improving,
+            # because we've hit the limits of floating point precision)
+            # drop out of later steps.
+            step = np.maximum(np.abs(dl), np.abs(du))
+            stalled = (step >= last_step[active] / 2) & (step <= 1e-6 * (uu - ll))
+            done = (step <= xtol) | stalled | outside
+            last_step[active] = step
+            active = active[~done]
+            if len(active) == 0:
+                break
+
+    lower[interior] = l
+    upper[interior] = u
+    return (lower.reshape(shape), upper.reshape(shape))
+
+
+def asymptotic_beta_interval(a=None, b=None, confidence=None, shortest=True):
+    """
+    Approximate the "quick" (shortest=False) or shortest (shortest=True)
+    interval containing probability "confidence" under beta(a, b), for
+    large a and b.  Returns arrays (lower, upper, error_estimate), where
+    error_estimate roughly bounds the error of either endpoint.
+    """
+    # When a and b are large, beta(a, b) is nearly normal, and we can
+    # write its quantiles with a (second-order) Cornish-Fisher expansion
+    #
+    #   x(p) = mean + sd * w(z),  z = norm.ppf(p)
+    #   w(z) = z + g1/6 (z^2-1) + g2/24 (z^3-3z) - g1^2/36 (2z^3-5z)
+    #
+    # in terms of the skewness g1 and excess kurtosis g2.  The cost is a
+    # few calls to norm.cdf and norm.ppf, which are far cheaper than
+    # their beta counterparts.  The first omitted terms are smaller than
+    # the second-order terms by a further factor of about max(|g1|,
+    # sqrt|g2|); we scale that by 20, about twice the worst ratio we saw
+    # when we compared against the exact intervals.
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    n = a + b
+    mean = a / n
+    sd = np.sqrt(a * b / (n**2 * (n + 1)))
+    g1 = 2 * (b - a) * np.sqrt(n + 1) / ((n + 2) * np.sqrt(a * b))
+    g2 = 6 * ((a - b) ** 2 * (n + 1) - a * b * (n + 2)) / (a * b * (n + 2) * (n + 3))
+
+    def w(z):
+        return (
+            z
+            + g1 / 6 * (z**2 - 1)
+            + g2 / 24 * (z**3 - 3 * z)
+            - g1**2 / 36 * (2 * z**3 - 5 * z)
+        )
+
+    def dw(z):
+        return 1 + g1 / 3 * z + g2 / 8 * (z**2 - 1) - g1**2 / 36 * (6 * z**2 - 5)
+
+    def d2w(z):
+        return g1 / 3 + g2 / 4 * z - g1**2 / 3 * z
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        if shortest:
+            # The endpoints have equal density, pdf(x(p)) = norm.pdf(z) /
+            # (sd * w'(z)), so solve h(z_l) = 0 for the lower endpoint by
+            # Newton's method, starting from the first-order guess.
+            z_l = -norm.ppf((1 + confidence) / 2) - g1 / 3
+            for step_count in range(20):
+                z_u = norm.ppf(norm.cdf(z_l) + confidence)
+                h = np.log(dw(z_u) / dw(z_l)) + (z_u**2 - z_l**2) / 2
+                dz_u = norm.pdf(z_l) / norm.pdf(z_u)
+                dh = z_u * dz_u - z_l + d2w(z_u) / dw(z_u) * dz_u - d2w(z_l) / dw(z_l)
+                step = h / dh
+                z_l = z_l - step
+                if not np.any(np.abs(step) > 1e-13):
+                    break
+            z_u = norm.ppf(norm.cdf(z_l) + confidence)
+        else:
+            # As in cdf_CI_marginal_quick(), with the cdf at the mode from
+            # the matching Edgeworth expansion.
+            t = ((a - 1) / (n - 2) - mean) / sd
+            mode_cumu_prob = norm.cdf(t) - norm.pdf(t) * (
+                g1 / 6 * (t**2 - 1)
+                + g2 / 24 * (t**3 - 3 * t)
+                + g1**2 / 72 * (t**5 - 10 * t**3 + 15 * t)
+            )
+            lower_prob = mode_cumu_prob * (1 - confidence)
+            z_l = norm.ppf(lower_prob)
+            z_u = norm.ppf(lower_prob + confidence)
+
+        lower = mean + sd * w(z_l)
+        upper = mean + sd * w(z_u)
+
+        def second_order(z):
+            return np.abs(g2 / 24 * (z**3 - 3 * z)) + np.abs(
+                g1**2 / 36 * (2 * z**3 - 5 * z)
+            )
+
+        error_estimate = (
+            20
+            * sd
+            * np.maximum(second_order(z_l), second_order(z_u))
+            * np.maximum(np.abs(g1), np.sqrt(np.abs(g2)))
+        )
+    # Anything that went wrong (e.g., a non-monotone expansion far out in
+    # the tails) shouldn't be trusted.
+    error_estimate[~np.isfinite(lower + upper)] = np.inf
+    error_estimate[~np.isfinite(error_estimate)] = np.inf
+    return (lower, upper, error_estimate)
+
+
+def cdf_CI_marginal_opt(a=None, N=None, confidence=None, **kwargs):
+    # The marginal distribution is beta-distributed, and this calculates a
+    # (marginal) confidence interval exactly.  There are different choices
+    # for the confidence interval.  If N>1, then there is a unique shortest
+    # confidence interval; because the beta distribution is (usually)
+    # asymmetric, computing this interval requires a little work.  (We use
+    # Newton's method to optimize; see shortest_beta_interval().)
+    lower, upper = cdf_band_marginal_opt(a=[a], N=N, confidence=confidence, **kwargs)
+    return (lower[0], upper[0])
 
 
 # Compute Dvoretzky-Kiefer-Wolfowitz confidence bands.
@@ -142,8 +288,242 @@ def confidence_interval_bounds(**kwargs):
     return (lower, upper)
 
 
+# Vectorized versions of the bounds above.  Here "a" is an array of
+# ranks and we compute the whole band with a handful of calls to
+# scipy's (vectorized) beta functions, rather than looping over
+# points in Python.  The results agree with the per-point functions
+# above to within BAND_ATOL; the unit tests check this.
+BAND_ATOL = 1e-12
+
+
+def cdf_band_marginal_quick(a=None, N=None, confidence=None, **kwargs):
+    # Array version of cdf_CI_marginal_quick()
+    a = np.asarray(a, dtype=float)
+    b = N + 1 - a
+    first = a == 1
+    last = a == N
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mode = (a - 1) / (a + b - 2)
+    mode_cumu_prob = beta.cdf(mode, a, b)
+    lower_prob = np.maximum(mode_cumu_prob - confidence * mode_cumu_prob, 0.0)
+    upper_prob = lower_prob + confidence
+    lower = beta.ppf(lower_prob, a, b)
+    upper = beta.ppf(upper_prob, a, b)
+
+    # Endpoints (as in the scalar version, a==1 takes precedence)
+    lower[last] = beta.ppf(1 - confidence, N, 1)
+    upper[last] = 1
+    lower[first] = 0
+    upper[first] = beta.ppf(confidence, 1, N)
+
+    return (lower, upper)
+
+
+def cdf_band_marginal_opt(a=None, N=None, confidence=None, **kwargs):
+    # Array version of cdf_CI_marginal_opt(); the rank "a" has a
+    # beta(a, N + 1 - a) distribution over quantiles.
+    a = np.asarray(a, dtype=float)
+    solver_kw = {k: kwargs[k] for k in ["max_steps", "xtol"] if k in kwargs}
+    return shortest_beta_interval(a=a, b=N + 1 - a, confidence=confidence, **solver_kw)
+
+
+def cdf_band_DKW(a=None, N=None, confidence=None, **kwargs):
+    # Array version of cdf_CI_DKW()
+    epsilon = np.sqrt(np.log(2.0 / (1 - confidence)) / (2.0 * float(N)))
+
+    y = ecdf_value(np.asarray(a), N, ecdf_type="classical")
+    return (y - epsilon, y + epsilon)
+
+
+def confidence_band(**kwargs):
+    """
+    Array version of confidence_interval_bounds(): given an array of
+    ranks "a", return arrays (lower, upper) for the whole band.
+    """
+    lower, upper, error_estimate = confidence_band_with_error(**kwargs)
+    return (lower, upper)
+
+
+# For large N, the marginal bands can be approximated (see
+# asymptotic_beta_interval()) far faster than we can compute them
+# exactly.  We do so for any rank whose estimated error is at most
+# "asymptotic_tol", so long as N is at least ASYMPTOTIC_MIN_N; ranks
+# within ASYMPTOTIC_MIN_RANK of either end, where the beta distribution
+# is far from normal, are always computed exactly.  Set
+# asymptotic_tol=None (or 0) to always compute the exact band.
+ASYMPTOTIC_TOL = 1e-6
+ASYMPTOTIC_MIN_N = 10**4
+ASYMPTOTIC_MIN_RANK = 100
+
+
+def confidence_band_with_error(**kwargs):
+    """
+    Like confidence_band(), but also return an array with the estimated
+    error of each rank's bounds (zero where we computed them exactly).
+    """
+    a = np.asarray(kwargs["a"])
+    N = kwargs["N"]
+    bound = kwargs["bound"]
+    confidence = kwargs["confidence"]
+    asymptotic_tol = kwargs.pop("asymptotic_tol", ASYMPTOTIC_TOL)
+    error_estimate = np.zeros(a.shape)
+
+    if confidence == 0:
+        v = ecdf_value(**dict(kwargs, a=a)) * np.ones(a.shape)
+        return (v, v.copy(), error_estimate)
+    if confidence == 1:
+        return (np.zeros(a.shape), np.ones(a.shape), error_estimate)
+
+    if bound == "simultaneous":
+        # A wider marginal_quick band.  (Imported here to avoid a
+        # circular import.)
+        from mirabolic.cdf.simultaneous import cdf_band_simultaneous
+
+        return cdf_band_simultaneous(**dict(kwargs, asymptotic_tol=asymptotic_tol))
+    if bound == "DKW":
+        fn = cdf_band_DKW
+    elif bound == "marginal_quick":
+        fn = cdf_band_marginal_quick
+    elif bound == "marginal_opt":
+        fn = cdf_band_marginal_opt
+    else:
+        raise ValueError(f"Unknown bound {bound}")
+
+    candidates = np.zeros(a.shape, dtype=bool)
+    if bound != "DKW" and asymptotic_tol and N >= ASYMPTOTIC_MIN_N:
+        b = N + 1 - a
+        candidates = np.minimum(a, b) >= ASYMPTOTIC_MIN_RANK
+
+    if candidates.any():
+        lower = np.zeros(a.shape)
+        upper = np.zeros(a.shape)
+        approx_lower, approx_upper, approx_error = asymptotic_beta_interval(
+            a=a[candidates],
+            b=N + 1 - a[candidates],
+            confidence=confidence,
+            shortest=bound == "marginal_opt",
+        )
+        good = approx_error <= asymptotic_tol
+        approx = np.flatnonzero(candidates)[good]
+        lower[approx] = approx_lower[good]
+        upper[approx] = approx_upper[good]
+        error_estimate[approx] = approx_error[good]
+
+        exact = np.ones(a.shape, dtype=bool)
+        exact[approx] = False
+        if exact.any():
+            lower[exact], upper[exact] = fn(**dict(kwargs, a=a[exact]))
+    else:
+        lower, upper = fn(**kwargs)
+    lower = np.maximum(lower, 0)
+    upper = np.minimum(upper, 1)
+
+    return (lower, upper, error_estimate)
+
+
+def interpolated_band(
+    N=None,
+    confidence=None,
+    bound="marginal_opt",
+    ecdf_type=None,
+    tol=1e-8,
+    asymptotic_tol=ASYMPTOTIC_TOL,
+    max_rounds=30,
+    a=None,
+):
+    """
+    Compute the band at every rank a = 1, ..., N (or at the ranks "a"),
+    by computing it exactly at a few hundred anchor ranks and
+    interpolating in between.  Returns arrays (lower, upper) and an error
+    estimate; the interpolation is checked against exact values at ranks
+    between the anchors.
+    """
+    # Near the mode (a-1)/(N-1), in units of the beta distribution's
+    # standard deviation, the band's offsets change slowly and smoothly
+    # with the log-odds of the rank, so we interpolate them (with
+    # monotone cubics) in those coordinates.  The anchors start from the
+    # same kind of grid as adaptive_index_list().  We then check the
+    # band midway between each pair of anchors; any rank where the
+    # interpolation is off by more than tol/2 becomes an anchor, and we
+    # repeat.  (Away from the checked ranks, we have seen errors up to
+    # about 1.6 times those at the checked ranks, so we report twice the
+    # largest checked error.)
+    band_kw = dict(
+        N=N,
+        confidence=confidence,
+        bound=bound,
+        ecdf_type=ecdf_type,
+        asymptotic_tol=asymptotic_tol,
+    )
+    a = np.arange(1, N + 1) if a is None else np.asarray(a)
+    if N < 1000 or bound == "DKW" or confidence in (0, 1):
+        # Cheap enough to compute exactly
+        lower, upper, error_estimate = confidence_band_with_error(a=a, **band_kw)
+        return (lower, upper, float(error_estimate.max()))
+
+    def coordinates(a):
+        a = np.asarray(a, dtype=float)
+        mode = (a - 1) / (N - 1)
+        sd = np.sqrt(a * (N + 1 - a) / (N + 2)) / (N + 1)
+        return (mode, sd, np.log(a / (N + 1 - a)))
+
+    def fit(anchors, lower, upper):
+        mode, sd, t = coordinates(anchors)
+        fit_lower = interpolate.PchipInterpolator(t, (lower - mode) / sd)
+        fit_upper = interpolate.PchipInterpolator(t, (upper - mode) / sd)
+
+        def evaluate(a):
+            mode, sd, t = coordinates(a)
+            return (mode + sd * fit_lower(t), mode + sd * fit_upper(t))
+
+        return evaluate
+
+    tail = np.geomspace(1, N / 2, 32)
+    anchors = np.r_[np.linspace(1, N, 33), tail, N + 1 - tail]
+    anchors = np.unique(anchors.round()).astype(int)
+    anchor_lower, anchor_upper, error_estimate = confidence_band_with_error(
+        a=anchors, **band_kw
+    )
+    for round_count in range(max_rounds):
+        evaluate = fit(anchors, anchor_lower, anchor_upper)
+        check = (anchors[:-1] + anchors[1:]) // 2
+        check = check[np.diff(anchors) >= 2]
+        if len(check) == 0:
+            checked_error = 0.0
+            break
+        check_lower, check_upper, check_error = confidence_band_with_error(
+            a=check, **band_kw
+        )
+        fit_lower, fit_upper = evaluate(check)
+        miss = np.maximum(
+            np.abs(fit_lower - check_lower), np.abs(fit_upper - check_upper)
+        )
+        checked_error = miss.max()
+        bad = miss > tol / 2
+        if not bad.any():
+            break
+        anchors = np.r_[anchors, check[bad]]
+        order = np.argsort(anchors)
+        anchors = anchors[order]
+        anchor_lower = np.r_[anchor_lower, check_lower[bad]][order]
+        anchor_upper = np.r_[anchor_upper, check_upper[bad]][order]
+        error_estimate = np.r_[error_estimate, check_error[bad]][order]
+
+    lower, upper = evaluate(a)
+    # Use the exact values at anchors
+    position = np.minimum(np.searchsorted(anchors, a), len(anchors) - 1)
+    is_anchor = anchors[position] == a
+    lower[is_anchor] = anchor_lower[position[is_anchor]]
+    upper[is_anchor] = anchor_upper[position[is_anchor]]
+    lower = np.clip(lower, 0, 1)
+    upper = np.clip(upper, 0, 1)
+    return (lower, upper, 2 * checked_error + error_estimate.max())
+
+
 def ecdf_value(a=None, N=None, ecdf_type=None, bound=None, **kwargs):
-    assert a <= N
+    # Works for a single rank "a" or an array of ranks.
+    assert np.all(a <= N)
 
     # Note that the DKW inequality assumes the "classic"
     # definition of the empirical CDF, namely
@@ -176,15 +556,237 @@ def ecdf_value(a=None, N=None, ecdf_type=None, bound=None, **kwargs):
         ValueError(f"Unknown cdf_type {ecdf_type}")
 
 
+def plot_index_list(N, max_points):
+    # If we have a lot of data, then we neither want nor need to
+    # plot every point-- it would be very slow to compute, memory
+    # intensive to plot, and uninformative (because the envelope
+    # won't change much).  Instead, we plot only "max_points".
+    # If you really want to plot everything, set that value to 0 or None.
+    if max_points is None or max_points < 1:
+        N_plot = N
+    else:
+        N_plot = min(N, max_points)
+    # Choose N_plot numbers evenly spread between 0 and N-1 (inclusive)
+    return np.linspace(0, N - 1, N_plot).round().astype(int)
+
+
+def adaptive_index_list(N, max_points, band, tol=1e-3):
+    """
+    Choose up to max_points ranks (0-based, like plot_index_list()) so
+    that interpolating the band linearly between them is accurate to
+    about "tol", spending the points where the band bends most.  Here
+    "band" maps an array of ranks "a" (1-based) to arrays (lower, upper).
+    """
+    # The ECDF itself is a straight line in rank, so only the band needs
+    # placing points.  We start from a coarse grid (evenly spaced, plus
+    # geometrically spaced toward each end, where the band curves
+    # sharply), and repeatedly bisect the intervals where interpolation
+    # is worst.  Evaluating the
+    # band at the midpoint of an interval tells us how badly
+    # interpolation did there, and we estimate the error of each half as
+    # half of that.  (For smooth curves the error shrinks faster, like
+    # the square of the interval, but not at kinks, such as where the
+    # DKW band is clipped.)  Each round bisects (at once) as
+    # many of the worst intervals as the remaining budget allows.
+    if max_points is None or max_points < 3 or N <= max_points:
+        return plot_index_list(N, max_points)
+    k = max(2, min(8, max_points // 4))
+    tail = np.geomspace(1, N / 2, k)
+    a = np.r_[np.linspace(1, N, k + 1), tail, N + 1 - tail]
+    a = np.unique(a.round()).astype(int)
+    lower, upper = band(a)
+    error = np.full(len(a) - 1, np.inf)
+    while len(a) < max_points:
+        split = np.flatnonzero((np.diff(a) >= 2) & (error > tol))
+        if len(split) == 0:
+            break
+        worst = np.argsort(-error[split], kind="stable")
+        split = np.sort(split[worst[: max_points - len(a)]])
+
+        mid = (a[split] + a[split + 1]) // 2
+        mid_lower, mid_upper = band(mid)
+        frac = (mid - a[split]) / (a[split + 1] - a[split])
+        miss = np.maximum(
+            np.abs(mid_lower - lower[split] - frac * np.diff(lower)[split]),
+            np.abs(mid_upper - upper[split] - frac * np.diff(upper)[split]),
+        )
+
+        a = np.insert(a, split + 1, mid)
+        lower = np.insert(lower, split + 1, mid_lower)
+        upper = np.insert(upper, split + 1, mid_upper)
+        error = np.insert(error, split + 1, miss / 2)
+        error[split + np.arange(len(split))] = miss / 2
+    return a - 1
+
+
+def adaptive_cache(use_cache):
+    # Adaptive placement looks up the band as it goes; we keep what it
+    # finds in a band cache (a private one, if use_cache=False), so that
+    # compute_cdf_band() doesn't compute it all again.  (Imported here to
+    # avoid a circular import.)
+    from mirabolic.cdf.band_cache import band_cache, get_band_cache
+
+    if use_cache is True:
+        return get_band_cache()
+    if not use_cache:
+        return band_cache(maxsize=1, max_bytes=None)
+    return use_cache
+
+
+def choose_index_list(
+    N=None, max_points=None, placement="uniform", placement_tol=1e-3, cache=None, **kw
+):
+    """
+    Choose the ranks to plot: evenly spaced (see plot_index_list()) or,
+    if placement="adaptive", where the band bends most (see
+    adaptive_index_list(), which looks up the band with cache.band(**kw)).
+    """
+    if placement == "uniform" or N == 1:
+        return plot_index_list(N, max_points)
+
+    def band(a):
+        return cache.band(a=a, N=N, **kw)
+
+    return adaptive_index_list(N, max_points, band, tol=placement_tol)
+
+
+def order_statistics(data, index_list, method="auto", overwrite_data=False):
+    """
+    Return np.sort(data)[index_list], without necessarily sorting all
+    the data.  The method is "sort", "select" (repeated partitioning) or
+    "auto" (pick whichever should be faster).
+    """
+    assert method in {"auto", "sort", "select"}
+    N = len(data)
+    kth = np.unique(index_list)
+    if method == "auto":
+        # Sorting costs ~N log(N).  Selecting k order statistics by
+        # partitioning costs ~N log(k), but each pass is a good deal
+        # slower than numpy's (heavily optimized) sort.  Empirically,
+        # selection wins when log(k) is below about log(N) / 4, i.e., for
+        # large N and few plotted points.
+        method = "select" if 1 + np.log2(len(kth)) < np.log2(N) / 4 else "sort"
+
+    if not overwrite_data:
+        data = data.copy()
+    if method == "sort":
+        data.sort()
+        return data[index_list]
+
+    # Partition around the middle rank, then recurse into the two halves,
+    # so that each level of the recursion touches each value once.
+    stack = [(0, N, 0, len(kth))]
+    while stack:
+        lo, hi, i, j = stack.pop()
+        if i == j:
+            continue
+        m = (i + j) // 2
+        data[lo:hi].partition(kth[m] - lo)
+        stack.append((lo, kth[m], i, m))
+        stack.append((kth[m] + 1, hi, m + 1, j))
+    return data[index_list]
+
+
+def clean_data(data):
+    """
+    Convert data (a list, PANDAS series, etc.) to a Numpy array of finite
+    numbers.  Returns (data, is_copy), where "is_copy" tells us whether
+    we made a new array (which we are then free to overwrite).
+    """
+    is_copy = False
+    if not isinstance(data, np.ndarray) and hasattr(data, "to_numpy"):
+        # Extract data from a PANDAS series (without importing PANDAS)
+        data = data.to_numpy()
+    if not isinstance(data, np.ndarray):
+        # Try to convert, e.g., list to Numpy array
+        data = np.array(data)
+        is_copy = True
+
+    if len(data) == 0:
+        raise ValueError("Data length is zero!")
+
+    # Make sure we have numbers...
+    assert np.issubdtype(data.dtype, np.number)
+    # Make sure no NaNs or Infs...
+    if not np.isfinite(data).all():
+        bad_index = np.min(np.where(~np.isfinite(data)))
+        msg = f"Nonfinite values!  data[{bad_index}] = {data[bad_index]}"
+        raise ValueError(msg)
+
+    return (data, is_copy)
+
+
+def clean_weights(data, counts=None, weights=None):
+    """
+    Check data given as values with "counts" (how many times each value
+    occurs) or "weights".  Returns (values, weights, N), where N is the
+    number of data points the values stand for: the total count, or, for
+    weights, the effective sample size (Kish's formula, rounded).
+    """
+    assert counts is None or weights is None
+    data, is_copy = clean_data(data)
+    w = np.asarray(counts if weights is None else weights).ravel()
+    if len(w) != len(data):
+        raise ValueError(f"Got {len(data)} values but {len(w)} counts or weights")
+    assert np.issubdtype(w.dtype, np.number)
+    # Make sure no NaNs, Infs or negative weights...
+    if not (np.isfinite(w) & (w >= 0)).all():
+        bad_index = np.min(np.where(~(np.isfinite(w) & (w >= 0))))
+        msg = f"Bad count or weight!  w[{bad_index}] = {w[bad_index]}"
+        raise ValueError(msg)
+    if w.sum() == 0:
+        raise ValueError("Total count or weight is zero!")
+
+    if counts is not None:
+        if not (w == np.round(w)).all():
+            raise ValueError("Counts must be whole numbers (or use weights instead)")
+        w = w.astype(np.int64)
+        N = int(w.sum())
+    else:
+        # Kish's effective sample size
+        w = w.astype(float)
+        N = max(1, int(round(w.sum() ** 2 / (w**2).sum())))
+    return (data, w, N)
+
+
+def weighted_order_statistics(values, weights, index_list, N):
+    """
+    Return the order statistics sorted(expanded)[index_list], where
+    "expanded" repeats each of the "values" as many times as its weight.
+    (Weights are scaled to add up to N.)  The cost depends on the
+    number of distinct values, not on N.
+    """
+    order = np.argsort(values, kind="stable")
+    cumulative = np.cumsum(weights[order])
+    if cumulative[-1] != N:
+        cumulative = cumulative * (N / cumulative[-1])
+        # Don't let roundoff move a value across a rank
+        nearest = np.round(cumulative)
+        snap = np.abs(cumulative - nearest) <= 1e-9 * N
+        cumulative[snap] = nearest[snap]
+    position = np.searchsorted(cumulative, index_list, side="right")
+    return values[order][np.minimum(position, len(values) - 1)]
+
+
 def cdf_plot(
     # Key arguments
     data=None,
     confidence=0.9,  # How wide is the confidence interval/band?
+    counts=None,  # If given, data[i] occurs counts[i] times
+    weights=None,  # If given, data[i] has weight weights[i]
     # Statistical and control parameters
     presorted=False,  # Is the data already sorted?
-    bound="marginal_opt",  # What kind of CI? (E.g., DKW or marginal?)
+    selection="auto",  # Sort the data, or just select order statistics?
+    overwrite_data=False,  # May we reorder "data" in place to save memory?
+    bound="marginal_opt",  # What kind of CI? (E.g., DKW, marginal or simultaneous?)
     ecdf_type=None,  # Exactly how do we define the empirical CDF?
     max_points=128,  # How many points to compute?
+    placement="uniform",  # Spread the points evenly, or where the band bends?
+    placement_tol=1e-3,  # For adaptive placement, how accurate should the band be?
+    use_cache=True,  # Look up the band in the band cache? (Or, which band_cache?)
+    asymptotic_tol=ASYMPTOTIC_TOL,  # Error allowed to approximate the band for large N
+    interpolation_tol=None,  # If given, interpolate the band (for max_points=None)
+    sketch_failure_prob=0.01,  # If data is a kll_sketch, risk of exceeding its error
     # Plotting parameters
     plot_figure=True,  # Should we plot the data (or only return the results?)
     color=None,
@@ -195,101 +797,174 @@ def cdf_plot(
 ):
     """
     Given a collection of real-valued observations, plot a CDF with a
-    confidence band around the values.
+    confidence band around the values.  Tied data can be passed as its
+    distinct values with "counts"; for "weights", the band uses the
+    effective sample size.
     """
 
     # Check input arguments
     assert confidence >= 0 and confidence <= 1
-    assert bound in {"marginal_quick", "marginal_opt", "DKW"}
+    assert bound in {"marginal_quick", "marginal_opt", "simultaneous", "DKW"}
     assert ecdf_type in {"classical", "mode", "mean", None}
+    assert placement in {"uniform", "adaptive"}
 
-    # Clean up data types
-    if isinstance(data, pd.core.series.Series):
-        # Extract data from PANDAS data frame
-        data = data.values
-    if not isinstance(data, np.ndarray):
-        # Try to convert, e.g., list to Numpy array
-        data = np.array(data)
-
-    N = len(data)
-    if N == 0:
-        raise ValueError("Data length is zero!")
+    if placement == "adaptive":
+        use_cache = adaptive_cache(use_cache)
+    placement_kw = dict(
+        max_points=max_points,
+        placement=placement,
+        placement_tol=placement_tol,
+        cache=use_cache,
+        confidence=confidence,
+        bound=bound,
+        ecdf_type=ecdf_type,
+        asymptotic_tol=asymptotic_tol,
+    )
 
-    # Make sure we have numbers...
-    assert np.issubdtype(data.dtype, np.number)
-    # Make sure no NaNs or Infs...
-    if not np.isfinite(data).all():
-        bad_index = np.min(np.where(~np.isfinite(data)))
-        msg = f"Nonfinite values!  data[{bad_index}] = {data[bad_index]}"
-        raise ValueError(msg)
+    sketch_rank_error = None
+    if isinstance(data, kll_sketch):
+        # A (possibly merged) quantile sketch; we estimate the order
+        # statistics from it, and widen the band by its rank error.
+        N = data.n
+        if N == 0:
+            raise ValueError("Data length is zero!")
+        index_list = choose_index_list(N, **placement_kw)
+        x = data.order_statistics(index_list)
+        sketch_rank_error = data.rank_error(failure_prob=sketch_failure_prob)
+    elif counts is not None or weights is not None:
+        # Ranks come from the cumulative counts, so we never expand the
+        # data into a full array.
+        values, w, N = clean_weights(data, counts=counts, weights=weights)
+        index_list = choose_index_list(N, **placement_kw)
+        x = weighted_order_statistics(values, w, index_list, N)
+    else:
+        data, owns_data = clean_data(data)
+        N = len(data)
+        index_list = choose_index_list(N, **placement_kw)
 
-    # Sort data if necessary
-    if presorted == False:
-        # We can't risk overwriting the original data, so we
-        # make a copy.  (If data is presorted, we can skip this
-        # and save the memory).
-        data = np.sort(data)
+        # Find the order statistics we need.  If the data isn't presorted,
+        # we can't risk overwriting the original data, so we work on a copy
+        # (unless we made the array ourselves, or the caller allows it).
+        if presorted:
+            x = data[index_list]
+        else:
+            x = order_statistics(
+                data,
+                index_list,
+                method=selection,
+                overwrite_data=owns_data or overwrite_data,
+            )
 
-    # If we have a lot of data, then we neither want nor need to
-    # plot every point-- it would be very slow to compute, memory
-    # intensive to plot, and uninformative (because the envelope
-    # won't change much).  Instead, we plot only "max_points".
-    # If you really want to plot everything, set that value to 0 or None.
-    if max_points is None or max_points < 1:
-        N_plot = N
-    N_plot = min(N, max_points)
-    # Choose N_plot numbers evenly spread between 0 and N-1 (inclusive)
-    index_list = np.linspace(0, N - 1, N_plot).round().astype(int)
-
-    # Compute estimates
-    x = []
-    y = []
-    y_lower = []
-    y_upper = []
-    for i in index_list:
-        a = i + 1
-        x.append(data[i])  # i-th largest value
-        y.append(ecdf_value(a=a, N=N, ecdf_type=ecdf_type, bound=bound))
-        if N == 1:
-            # Special case N==1 to avoid possible edge cases
-            tail = (1.0 - confidence) / 2
-            y_lower.append(tail)
-            y_upper.append(1 - tail)
-            break
+    results = compute_cdf_band(
+        x=x,
+        index_list=index_list,
+        N=N,
+        confidence=confidence,
+        bound=bound,
+        ecdf_type=ecdf_type,
+        use_cache=use_cache,
+        asymptotic_tol=asymptotic_tol,
+        interpolation_tol=interpolation_tol,
+        rank_error=sketch_rank_error,
+    )
 
-        lower, upper = confidence_interval_bounds(
-            a=a, N=N, confidence=confidence, bound=bound, ecdf_type=ecdf_type
+    if plot_figure:
+        plot_cdf_band(
+            results,
+            color=color,
+            ax=ax,
+            plot_central_kw=plot_central_kw,
+            plot_confidence_kw=plot_confidence_kw,
+            seaborn=seaborn,
         )
-        y_lower.append(lower)
-        y_upper.append(upper)
-    x = np.array(x)
-    y = np.array(y)
-    y_upper = np.array(y_upper)
-    y_lower = np.array(y_lower)
 
-    if plot_figure:
-        # Use Seaborn defaults if desired
-        if seaborn:
-            sns.set_theme()
+    return results
 
-        # Use specified or default Matplotlib axis
-        if ax is None:
-            ax = plt.gca()
 
-        if plot_central_kw is None:
-            plot_central_kw = {}
-        if plot_confidence_kw is None:
-            plot_confidence_kw = {}
+def compute_cdf_band(
+    x=None,
+    index_list=None,
+    N=None,
+    confidence=0.9,
+    bound="marginal_opt",
+    ecdf_type=None,
+    use_cache=True,
+    asymptotic_tol=ASYMPTOTIC_TOL,
+    interpolation_tol=None,
+    rank_error=None,
+):
+    """
+    Given the order statistics x = sorted(data)[index_list] of N
+    observations, compute the CDF and its confidence band, returning the
+    "results" dict of cdf_plot().  If the ranks of x are only known to
+    within a fraction "rank_error" of N (e.g., from a quantile sketch),
+    we widen the band to match.  For large N, the band may be
+    approximated (see confidence_band_with_error()), or, if
+    interpolation_tol is given, interpolated (see interpolated_band());
+    "band_method" reports which, and "band_error_estimate" the largest
+    estimated error.
+    """
+    # Compute estimates.  We evaluate the whole band at once (see
+    # confidence_band()), rather than point by point.
+    a = index_list + 1
+    y = ecdf_value(a=a, N=N, ecdf_type=ecdf_type, bound=bound)
+    if N == 1:
+        # Special case N==1 to avoid possible edge cases
+        tail = (1.0 - confidence) / 2
+        y_lower = np.array([tail])
+        y_upper = np.array([1 - tail])
+        error = np.zeros(1)
+    elif interpolation_tol is not None:
+        # Interpolate the band, evaluating it only at our ranks
+        y_lower, y_upper, error_estimate = interpolated_band(
+            a=a,
+            N=N,
+            confidence=confidence,
+            bound=bound,
+            ecdf_type=ecdf_type,
+            tol=interpolation_tol,
+            asymptotic_tol=asymptotic_tol,
+        )
+        error = np.full(len(a), error_estimate)
+    elif use_cache:
+        # The band doesn't depend on the data values, so we can reuse it
+        # across calls with the same N.  (Imported here to avoid a
+        # circular import.)
+        from mirabolic.cdf.band_cache import get_band_cache
 
-        default_plot_confidence_kw = dict(alpha=0.3)
-        default_plot_confidence_kw.update(plot_confidence_kw)
-        plot_confidence_kw = default_plot_confidence_kw
-        if color is not None:
-            plot_central_kw.update({"color": color})
-            plot_confidence_kw.update({"color": color})
+        cache = get_band_cache() if use_cache is True else use_cache
+        y_lower, y_upper, error = cache.band_with_error(
+            a=a,
+            N=N,
+            confidence=confidence,
+            bound=bound,
+            ecdf_type=ecdf_type,
+            asymptotic_tol=asymptotic_tol,
+        )
+    else:
+        y_lower, y_upper, error = confidence_band_with_error(
+            a=a,
+            N=N,
+            confidence=confidence,
+            bound=bound,
+            ecdf_type=ecdf_type,
+            asymptotic_tol=asymptotic_tol,
+        )
 
-        plt.plot(x, y, **plot_central_kw)
-        plt.fill_between(x, y_lower, y_upper, **plot_confidence_kw)
+    # Which ranks did we approximate?
+    approximated = error > 0
+    if interpolation_tol is not None and N > 1:
+        band_method = "interpolated"
+    elif approximated.all():
+        band_method = "asymptotic"
+    elif approximated.any():
+        band_method = "mixed"
+    else:
+        band_method = "exact"
+
+    if rank_error is not None:
+        y_lower = np.maximum(y_lower - rank_error, 0)
+        y_upper = np.minimum(y_upper + rank_error, 1)
 
     DKW_epsilon_bound = None
     if bound == "DKW":
@@ -302,5 +977,49 @@ def cdf_plot(
         y_upper=y_upper,
         index_list=index_list,
         DKW_epsilon_bound=DKW_epsilon_bound,
+        sketch_rank_error=rank_error,
+        band_method=band_method,
+        band_error_estimate=float(error.max(initial=0)),
     )
     return results
+
+
+def plot_cdf_band(
+    results,
+    color=None,
+    ax=None,
+    plot_central_kw=None,  # Arguments to pass to plot(CDF)
+    plot_confidence_kw=None,  # Arguments to pass to plot(confidence band)
+    seaborn=True,
+):
+    """
+    Plot the CDF and confidence band computed by compute_cdf_band().
+    """
+    # Only load the plotting libraries when we plot
+    import matplotlib.pyplot as plt
+
+    # Use Seaborn defaults if desired
+    if seaborn:
+        import seaborn as sns
+
+        sns.set_theme()
+
+    # Use specified or default Matplotlib axis
+    if ax is None:
+        ax = plt.gca()
+
+    if plot_central_kw is None:
+        plot_central_kw = {}
+    if plot_confidence_kw is None:
+        plot_confidence_kw = {}
+
+    default_plot_confidence_kw = dict(alpha=0.3)
+    default_plot_confidence_kw.update(plot_confidence_kw)
+    plot_confidence_kw = default_plot_confidence_kw
+    if color is not None:
+        plot_central_kw.update({"color": color})
+        plot_confidence_kw.update({"color": color})
+
+    x = results["x"]
+    plt.plot(x, results["y"], **plot_central_kw)
+    plt.fill_between(x, results["y_lower"], results["y_upper"], **plot_confidence_kw)
@@ -0,0 +1,328 @@
+# Plot a CDF (with confidence band) of data too large to fit in memory.
+#
+# cdf_plot() only needs the order statistics at the plotted ranks, not
+# the whole sorted data set.  Here we find those order statistics exactly
+# by making a few passes over the data, one chunk at a time:
+#
+#   1) Count the data, and histogram it into a fixed number of bins.
+#   2) Each plotted rank lands in some bin.  If that bin holds only a
+#      few values, gather them on the next pass and pick out the order
+#      statistic exactly; otherwise, split the bin into sub-bins and
+#      histogram again.
+#
+# To make the bins work for any data (huge dynamic range, heavy ties),
+# we bin on 64-bit integer keys that sort in the same order as the data
+# (for floats, the reinterpreted bits), so each pass shrinks a bin by a
+# factor of "bins" and a handful of passes always suffices.
+
+import os
+import numpy as np
+
+from mirabolic.cdf.cdf_tools import (
+    adaptive_cache,
+    choose_index_list,
+    compute_cdf_band,
+    plot_cdf_band,
+    ASYMPTOTIC_TOL,
+)
+
+# Flips the non-sign bits of negative floats (see sort_keys())
+KEY_MASK = np.int64(0x7FFFFFFFFFFFFFFF)
+
+
+def chunk_source(data=None, column=None, chunk_size=2**20):
+    """
+    Return a function which, each time it is called, yields "data" as a
+    sequence of NumPy arrays.  "data" may be an array (including an
+    np.memmap), a list of arrays, a function returning an iterator of
+    arrays, or the path of a Parquet file (with "column" naming the
+    column to read).
+    """
+    if isinstance(data, np.ndarray):
+
+        def chunks():
+            for start in range(0, len(data), chunk_size):
+                yield np.asarray(data[start : start + chunk_size])
+
+    elif isinstance(data, (str, os.PathLike)):
+        if column is None:
+            raise ValueError("Must specify which column of the Parquet file to read")
+        # Only needed for Parquet, so we don't require it in general
+        import pyarrow.parquet as pq
+
+        def chunks():
+            parquet_file = pq.ParquetFile(data)
+            for batch in parquet_file.iter_batches(
+                batch_size=chunk_size, columns=[column]
+            ):
+                yield batch.column(0).to_numpy(zero_copy_only=False)
+
+    elif callable(data):
+        chunks = data
+    elif isinstance(data, (list, tuple)):
+
+        def chunks():
+            for chunk in data:
+                yield np.asarray(chunk)
+
+    else:
+        # In particular, we can't use a generator, because we need to
+        # read the data several times.
+        raise ValueError(
+            f"Can't read data of type {type(data)} in chunks; try passing a "
+            "function which returns a fresh iterator each time it's called."
+        )
+    return chunks
+
+
+def sort_keys(values):
+    # Map values to int64 keys that sort in the same order.  Floats (at
+    # most 64 bits) are reinterpreted as integers; for negative floats,
+    # we flip the non-sign bits so that larger magnitudes sort lower.
+    if np.issubdtype(values.dtype, np.integer):
+        return values.astype(np.int64)
+    bits = values.astype(np.float64).view(np.int64)
+    return bits ^ ((bits >> 63) & KEY_MASK)
+
+
+def keys_to_values(keys, dtype):
+    # Inverse of sort_keys()
+    if np.issubdtype(dtype, np.integer):
+        return keys.astype(dtype)
+    bits = keys ^ ((keys >> 63) & KEY_MASK)
+    return bits.view(np.float64).astype(dtype)
+
+
+def chunked_order_statistics(chunks=None, index_list=None, bins=1024, max_buffer=2**20):
+    """
+    Find the order statistics sorted(data)[index_list] exactly, reading
+    the data chunk by chunk via the function "chunks" (see chunk_source()).
+    "index_list" may also be a function of N, the number of data points.
+    We hold at most about "max_buffer" values in memory at once (plus a
+    chunk).  Returns (N, index_list, x).
+    """
+    assert bins >= 2
+
+    # First pass: count the data, check it, and histogram it over the
+    # whole key range.
+    N = 0
+    dtype = None
+    cells = key_cells(
+        np.array([np.iinfo(np.int64).min]), np.array([np.iinfo(np.int64).max])
+    )
+    for chunk in chunks():
+        chunk = np.asarray(chunk).ravel()
+        if dtype is None:
+            dtype = chunk.dtype
+            # Make sure we have numbers...
+            assert np.issubdtype(dtype, np.number)
+        # Make sure no NaNs or Infs...
+        if not np.isfinite(chunk).all():
+            bad_index = np.min(np.where(~np.isfinite(chunk)))
+            msg = f"Nonfinite values!  data[{N + bad_index}] = {chunk[bad_index]}"
+            raise ValueError(msg)
+        cells.histogram(sort_keys(chunk), bins)
+        N += len(chunk)
+    if N == 0:
+        raise ValueError("Data length is zero!")
+
+    if callable(index_list):
+        index_list = index_list(N)
+    index_list = np.asarray(index_list)
+    ranks = np.unique(index_list)
+    found = {}
+
+    # Later passes: narrow down the cells holding the ranks we want
+    while True:
+        cells, pending = cells.refine(ranks, bins, max_buffer, found)
+        if len(pending) == 0:
+            break
+        for chunk in chunks():
+            keys = sort_keys(np.asarray(chunk).ravel())
+            cells.histogram(keys, bins)
+            cells.gather(keys)
+        ranks = pending
+
+    keys = np.array([found[i] for i in index_list], dtype=np.int64)
+    return (N, index_list, keys_to_values(keys, dtype))
+
+
+class key_cells:
+    # A sorted collection of disjoint key ranges [low, high] (inclusive)
+    # that hold the ranks we are looking for.  On each pass, a cell is
+    # either split into sub-bins (and histogrammed), or, if it holds
+    # few enough values, all its values are gathered.
+    def __init__(self, low, high, below=None, split=None):
+        self.low = low
+        self.high = high
+        # Number of data points with keys below each cell
+        self.below = np.zeros(len(low), dtype=np.int64) if below is None else below
+        if split is None:
+            split = np.ones(len(low), dtype=bool)
+        self.split = split
+        self.counts = np.zeros((len(low), 0), dtype=np.int64)
+        self.gathered = [[] for _ in range(len(low))]
+
+    def locate(self, keys):
+        # Which cell (if any) holds each key?
+        cell = np.searchsorted(self.low, keys, side="right") - 1
+        inside = cell >= 0
+        inside[inside] = keys[inside] <= self.high[cell[inside]]
+        return cell, inside
+
+    def step(self, bins):
+        # Width of the sub-bins of each cell.  (We use unsigned
+        # arithmetic, since a cell may span the whole int64 range.)
+        width = self.high.view(np.uint64) - self.low.view(np.uint64)
+        return width // np.uint64(bins) + np.uint64(1)
+
+    def histogram(self, keys, bins):
+        if not self.split.any():
+            return
+        if self.counts.shape[1] == 0:
+            self.counts = np.zeros((len(self.low), bins), dtype=np.int64)
+        cell, inside = self.locate(keys)
+        inside[inside] = self.split[cell[inside]]
+        cell, keys = cell[inside], keys[inside]
+        offset = keys.view(np.uint64) - self.low[cell].view(np.uint64)
+        sub_bin = (offset // self.step(bins)[cell]).astype(np.int64)
+        self.counts += np.bincount(
+            cell * bins + sub_bin, minlength=self.counts.size
+        ).reshape(self.counts.shape)
+
+    def gather(self, keys):
+        if self.split.all():
+            return
+        cell, inside = self.locate(keys)
+        inside[inside] = ~self.split[cell[inside]]
+        cell, keys = cell[inside], keys[inside]
+        if len(cell) == 0:
+            return
+        order = np.argsort(cell, kind="stable")
+        cell, keys = cell[order], keys[order]
+        boundaries = np.flatnonzero(np.diff(cell)) + 1
+        for c, k in zip(cell[np.r_[0, boundaries]], np.split(keys, boundaries)):
+            if len(k):
+                self.gathered[c].append(k)
+
+    def refine(self, ranks, bins, max_buffer, found):
+        # Resolve whatever ranks we can, and build the cells for the next
+        # pass.  Returns (new cells, ranks still pending).
+        c = np.searchsorted(self.below, ranks, side="right") - 1
+        rank_in_cell = ranks - self.below[c]
+
+        # If we gathered every value in a cell, just pick out the ranks
+        gathered = ~self.split[c]
+        for cell in np.unique(c[gathered]):
+            values = np.sort(np.concatenate(self.gathered[cell]))
+            mine = gathered & (c == cell)
+            found.update(zip(ranks[mine], values[rank_in_cell[mine]]))
+        ranks, c, rank_in_cell = ranks[~gathered], c[~gathered], rank_in_cell[~gathered]
+        if len(ranks) == 0:
+            return (self, ranks)
+
+        # Otherwise, find the sub-bin holding each rank.  (We search the
+        # cumulative counts of all the cells at once.)
+        cumulative = np.cumsum(self.counts.ravel())
+        earlier = np.r_[0, cumulative][c * bins]
+        flat_bin = np.searchsorted(cumulative, earlier + rank_in_cell, side="right")
+        sub_bin = flat_bin - c * bins
+        count = self.counts.ravel()[flat_bin]
+        below = self.below[c] + cumulative[flat_bin] - count - earlier
+
+        step = self.step(bins)[c]
+        low = self.low[c].view(np.uint64) + sub_bin.astype(np.uint64) * step
+        remaining = self.high[c].view(np.uint64) - low
+        high = low + np.minimum(step - np.uint64(1), remaining)
+        low, high = low.view(np.int64), high.view(np.int64)
+
+        # A sub-bin holding a single key resolves the rank
+        single = low == high
+        found.update(zip(ranks[single], low[single]))
+        pending = ranks[~single]
+
+        # Several ranks may share a sub-bin
+        flat_bin, first = np.unique(flat_bin[~single], return_index=True)
+        index = np.flatnonzero(~single)[first]
+        split = count[index] > max_buffer // max(len(index), 1)
+        new_cells = key_cells(low[index], high[index], below=below[index], split=split)
+        return (new_cells, pending)
+
+
+def cdf_plot_chunked(
+    # Key arguments
+    data=None,  # Array, memmap, list of arrays, function, or Parquet path
+    column=None,  # Column to read, if "data" is a Parquet file
+    chunk_size=2**20,  # How many values to read at once?
+    max_buffer=2**20,  # Most values to hold in memory while selecting
+    confidence=0.9,
+    # Statistical and control parameters
+    bound="marginal_opt",
+    ecdf_type=None,
+    max_points=128,
+    placement="uniform",
+    placement_tol=1e-3,
+    use_cache=True,
+    asymptotic_tol=ASYMPTOTIC_TOL,
+    # Plotting parameters
+    plot_figure=True,
+    color=None,
+    ax=None,
+    plot_central_kw=None,
+    plot_confidence_kw=None,
+    seaborn=True,
+):
+    """
+    Like cdf_plot(), but never holds the full data set in memory; see
+    chunk_source() for the kinds of data we can read.  Returns the same
+    results as cdf_plot().
+    """
+    assert confidence >= 0 and confidence <= 1
+    assert bound in {"marginal_quick", "marginal_opt", "simultaneous", "DKW"}
+    assert ecdf_type in {"classical", "mode", "mean", None}
+    if max_points is None or max_points < 1:
+        # Every order statistic is the same as the whole data set
+        raise ValueError("cdf_plot_chunked() needs a finite max_points")
+    assert placement in {"uniform", "adaptive"}
+    if placement == "adaptive":
+        use_cache = adaptive_cache(use_cache)
+    placement_kw = dict(
+        max_points=max_points,
+        placement=placement,
+        placement_tol=placement_tol,
+        cache=use_cache,
+        confidence=confidence,
+        bound=bound,
+        ecdf_type=ecdf_type,
+        asymptotic_tol=asymptotic_tol,
+    )
+
+    chunks = chunk_source(data=data, column=column, chunk_size=chunk_size)
+    N, index_list, x = chunked_order_statistics(
+        chunks=chunks,
+        index_list=lambda N: choose_index_list(N, **placement_kw),
+        max_buffer=max_buffer,
+    )
+
+    results = compute_cdf_band(
+        x=x,
+        index_list=index_list,
+        N=N,
+        confidence=confidence,
+        bound=bound,
+        ecdf_type=ecdf_type,
+        use_cache=use_cache,
+        asymptotic_tol=asymptotic_tol,
+    )
+
+    if plot_figure:
+        plot_cdf_band(
+            results,
+            color=color,
+            ax=ax,
+            plot_central_kw=plot_central_kw,
+            plot_confidence_kw=plot_confidence_kw,
+            seaborn=seaborn,
+        )
+
+    return results
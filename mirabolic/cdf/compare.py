@@ -0,0 +1,180 @@
+# Compare many pairs of samples at once.
+#
+# For each pair (x, y), we find the two-sample Kolmogorov-Smirnov
+# statistic D = max |F_x(z) - F_y(z)| with its p-value, and whether the
+# confidence bands of cdf_plot() overlap.  Both only need the sorted
+# samples: the ECDFs come from merging the two samples, and each band at
+# a point z comes from the rank r of z in its sample, as in reference.py:
+#
+#   F(z) lies within [lower band at rank r, upper band at rank r+1]
+#
+# We sort each distinct sample only once (so a baseline shared by many
+# pairs is sorted once), in a pool of threads as in batch.py, and
+# compute the band once per distinct sample size.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.stats import kstwo
+
+from mirabolic.cdf.band_cache import get_band_cache
+from mirabolic.cdf.cdf_tools import (
+    clean_data,
+    confidence_band,
+    plot_index_list,
+    ASYMPTOTIC_TOL,
+)
+
+
+def compare_distributions(
+    pairs=None,  # A list of pairs (x, y), or a dict mapping keys to pairs
+    confidence=0.9,
+    bound="marginal_opt",
+    max_points=128,  # How many points of each sample to check the bands at
+    use_cache=True,
+    asymptotic_tol=ASYMPTOTIC_TOL,
+    n_jobs=None,  # How many threads to use (by default, one per core)
+):
+    """
+    Compare each pair of samples (x, y) in "pairs".  Returns a dict of
+    arrays with one entry per pair: the two-sample KS "statistic" and its
+    (asymptotic) "pvalue", "bands_overlap" (whether the cdf_plot() bands
+    of x and y overlap at every point we check) and "band_separation"
+    (the largest gap between the bands, or 0).  If "pairs" is a dict,
+    "keys" lists the keys in the same order.
+    """
+    # Check input arguments
+    assert confidence >= 0 and confidence <= 1
+    assert bound in {"marginal_quick", "marginal_opt", "simultaneous", "DKW"}
+
+    keys = None
+    if isinstance(pairs, dict):
+        keys = list(pairs)
+        pairs = list(pairs.values())
+
+    # Sort each distinct sample once
+    samples = {}
+    for pair in pairs:
+        assert len(pair) == 2
+        for sample in pair:
+            samples.setdefault(id(sample), sample)
+
+    def sort(sample):
+        data, owns_data = clean_data(sample)
+        if not owns_data:
+            data = data.copy()
+        data.sort()
+        return data
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        sorted_samples = dict(zip(samples, pool.map(sort, samples.values())))
+        pairs = [(sorted_samples[id(x)], sorted_samples[id(y)]) for x, y in pairs]
+        compared = list(pool.map(lambda pair: compare_pair(*pair, max_points), pairs))
+    ks = [c[0] for c in compared]
+    grids = [c[1] for c in compared]
+
+    # For each distinct N, the band at every rank we need
+    needed = {}
+    for grid in grids:
+        for ranks, N in grid:
+            needed.setdefault(N, []).append(ranks)
+    band_kw = dict(
+        confidence=confidence,
+        bound=bound,
+        use_cache=use_cache,
+        asymptotic_tol=asymptotic_tol,
+    )
+    bands = {
+        N: rank_band(N, np.unique(np.concatenate(r)), **band_kw)
+        for N, r in needed.items()
+    }
+
+    separation = np.zeros(len(pairs))
+    for i, ((x_ranks, x_N), (y_ranks, y_N)) in enumerate(grids):
+        x_lower, x_upper = bands[x_N](x_ranks)
+        y_lower, y_upper = bands[y_N](y_ranks)
+        gap = np.maximum(x_lower - y_upper, y_lower - x_upper)
+        separation[i] = max(0.0, gap.max())
+
+    statistic = np.array([d for d, n, m in ks])
+    sizes = np.array([[n, m] for d, n, m in ks])
+    # As in scipy.stats.ks_2samp(method="asymp")
+    effective_n = np.round(sizes.prod(axis=1) / sizes.sum(axis=1))
+    pvalue = np.clip(kstwo.sf(statistic, effective_n), 0, 1)
+
+    results = dict(
+        statistic=statistic,
+        pvalue=pvalue,
+        bands_overlap=separation == 0,
+        band_separation=separation,
+    )
+    if keys is not None:
+        results["keys"] = keys
+    return results
+
+
+def compare_pair(x, y, max_points):
+    # The work for each pair (of sorted samples) that doesn't need the bands
+    return (ks_statistic(x, y), band_ranks(x, y, max_points))
+
+
+def ks_statistic(x, y):
+    # Returns (D, n, m) for sorted samples x and y of sizes n and m.  We
+    # merge the samples (a stable sort of two sorted runs takes linear
+    # time), and walk up the merged ranks: each point of x raises
+    # n*m*(F_x - F_y) by m, and each point of y lowers it by n.  We only
+    # look after the last of any tied values.
+    n, m = len(x), len(y)
+    z = np.r_[x, y]
+    order = np.argsort(z, kind="stable")
+    z = z[order]
+    difference = np.cumsum(np.where(order < n, m, -n))
+    last = np.r_[z[1:] != z[:-1], True]
+    return (float(np.abs(difference[last]).max() / (n * m)), n, m)
+
+
+def band_ranks(x, y, max_points):
+    # The points we check the bands at (the plotted order statistics of
+    # both samples), as ranks in each sample: for a point z of rank r, the
+    # band runs from the lower bound at rank r to the upper bound at rank
+    # r+1.  Returns ((x_ranks, len(x)), (y_ranks, len(y))).
+    z = np.r_[
+        x[plot_index_list(len(x), max_points)], y[plot_index_list(len(y), max_points)]
+    ]
+    return tuple(
+        (np.searchsorted(sample, z, side="right"), len(sample)) for sample in (x, y)
+    )
+
+
+def rank_band(
+    N, ranks, confidence=None, bound=None, use_cache=None, asymptotic_tol=None
+):
+    # Returns a function mapping ranks r (0 to N) to the band (lower at
+    # rank r, upper at rank r+1), evaluating the band only once, at the
+    # ranks we need.  (The lower bound at rank 0 is 0, and the upper
+    # bound at rank N+1 is 1.)
+    a = np.unique(np.r_[ranks, ranks + 1])
+    a = a[(a >= 1) & (a <= N)]
+    if N == 1:
+        # As in compute_cdf_band()
+        tail = (1.0 - confidence) / 2
+        lower, upper = np.full(len(a), tail), np.full(len(a), 1 - tail)
+    else:
+        band_kw = dict(
+            a=a, N=N, confidence=confidence, bound=bound, asymptotic_tol=asymptotic_tol
+        )
+        if use_cache:
+            cache = get_band_cache() if use_cache is True else use_cache
+            lower, upper = cache.band(**band_kw)
+        else:
+            lower, upper = confidence_band(**band_kw)
+    a = np.r_[0, a, N + 1]
+    lower = np.r_[0.0, lower, 0.0]
+    upper = np.r_[1.0, upper, 1.0]
+
+    def band(r):
+        return (lower[np.searchsorted(a, r)], upper[np.searchsorted(a, r + 1)])
+
+    return band
@@ -0,0 +1,103 @@
+# An ECDF that grows as new data arrives.
+#
+# Monitoring jobs often append a small batch of data to a large baseline
+# and redraw the CDF.  Rather than re-sorting everything each time, we
+# keep the data sorted, and merge each new (sorted) batch into place,
+# which costs one pass over the data instead of a full sort.  The band
+# is only recomputed when the data has changed, and then only at the
+# plotted ranks (via the band cache, which also remembers the bands of
+# sizes we've seen before).
+
+import numpy as np
+
+from mirabolic.cdf.cdf_tools import (
+    clean_data,
+    compute_cdf_band,
+    plot_cdf_band,
+    plot_index_list,
+    ASYMPTOTIC_TOL,
+)
+
+
+class incremental_ecdf:
+    def __init__(
+        self,
+        data=None,
+        confidence=0.9,
+        bound="marginal_opt",
+        ecdf_type=None,
+        max_points=128,
+        use_cache=True,
+        asymptotic_tol=ASYMPTOTIC_TOL,
+    ):
+        """
+        Accumulate data (starting from "data", if given) for a CDF with a
+        confidence band, as in cdf_plot().  Add data with update(), and
+        get the current results with band().
+        """
+        assert confidence >= 0 and confidence <= 1
+        assert bound in {"marginal_quick", "marginal_opt", "simultaneous", "DKW"}
+        assert ecdf_type in {"classical", "mode", "mean", None}
+        self.band_kw = dict(
+            confidence=confidence,
+            bound=bound,
+            ecdf_type=ecdf_type,
+            use_cache=use_cache,
+            asymptotic_tol=asymptotic_tol,
+        )
+        self.max_points = max_points
+        self.sorted_data = np.zeros(0)
+        self.results = None
+        if data is not None:
+            self.update(data)
+
+    def update(self, batch):
+        """
+        Merge a new batch of data into the sorted data.
+        """
+        batch, owns_batch = clean_data(batch)
+        if owns_batch:
+            batch.sort()
+        else:
+            batch = np.sort(batch)
+        if len(self.sorted_data) == 0:
+            self.sorted_data = batch
+        else:
+            # np.insert() casts to the type of the stored data, so (e.g.)
+            # floats added to integer data would be truncated
+            dtype = np.result_type(self.sorted_data, batch)
+            self.sorted_data = self.sorted_data.astype(dtype, copy=False)
+            batch = batch.astype(dtype, copy=False)
+            # Each new value goes after any equal values already present
+            position = np.searchsorted(self.sorted_data, batch, side="right")
+            self.sorted_data = np.insert(self.sorted_data, position, batch)
+        self.results = None
+        return self
+
+    def band(self):
+        """
+        Return the results of cdf_plot() for all the data so far.
+        """
+        if self.results is None:
+            N = len(self.sorted_data)
+            if N == 0:
+                raise ValueError("Data length is zero!")
+            index_list = plot_index_list(N, self.max_points)
+            self.results = compute_cdf_band(
+                x=self.sorted_data[index_list],
+                index_list=index_list,
+                N=N,
+                **self.band_kw,
+            )
+        return self.results
+
+    def plot(self, **kwargs):
+        """
+        Plot the current CDF; arguments are passed to plot_cdf_band().
+        """
+        results = self.band()
+        plot_cdf_band(results, **kwargs)
+        return results
+
+    def __len__(self):
+        return len(self.sorted_data)
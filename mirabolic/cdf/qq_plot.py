@@ -2,10 +2,17 @@
 # https://en.wikipedia.org/wiki/Q%E2%80%93Q_plot
 
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-sns.set()
+from mirabolic.cdf.band_cache import get_band_cache
+from mirabolic.cdf.cdf_tools import (
+    clean_data,
+    clean_weights,
+    confidence_band,
+    order_statistics,
+    plot_index_list,
+    weighted_order_statistics,
+)
+from mirabolic.cdf.chunked import chunk_source, chunked_order_statistics
 
 
 def qq_plot(
@@ -20,26 +27,75 @@ def qq_plot(
     linestyle=None,  # e.g.: "-", "--", or no line: ""
     alpha=None,
     label=None,
+    x_counts=None,  # If given, x[i] occurs x_counts[i] times
+    y_counts=None,
+    x_weights=None,  # If given, x[i] has weight x_weights[i]
+    y_weights=None,
+    selection="auto",  # Sort the data, or just select order statistics?
+    overwrite_data=False,  # May we reorder x and y in place to save memory?
+    chunk_size=2**20,  # For chunked data, how many values to read at once?
+    envelope=False,  # Add confidence envelopes around the quantiles?
+    confidence=0.9,  # How wide are the envelopes?
+    bound="marginal_opt",  # Which CDF band are they built from? (See cdf_plot())
+    use_cache=True,  # Look up the band in the band cache? (See band_cache.py)
+    envelope_kw=None,  # Arguments to pass to fill_between(envelope)
+    seaborn=True,  # Use Seaborn's look when plotting?
 ):
     """
     Construct a Q-Q plot between data sets "x" and "y".
     Plots N equally-spaced quantiles.  Returns the matched
-    quantiles.
+    quantiles.  Tied data can be passed as distinct values
+    with counts (or weights), as in cdf_plot().  Data too
+    large for memory can be an np.memmap or a function
+    returning an iterator of chunks, as in cdf_plot_chunked().
+
+    If envelope=True, we also return a dict with confidence
+    intervals on each plotted quantile of x and of y, and
+    shade them around the curve.
     """
     assert outlier_q < 0.5
-    if len(x) == len(y):
+    assert confidence >= 0 and confidence <= 1
+    # We only need the quantiles we plot (and those setting the axis
+    # limits), so we select just the order statistics around them.
+    limits = [outlier_q, 1 - outlier_q]
+    band_kw = None
+    if envelope:
+        band_kw = dict(confidence=confidence, bound=bound, use_cache=use_cache)
+    source_kw = dict(
+        N=N,
+        limits=limits,
+        band_kw=band_kw,
+        selection=selection,
+        overwrite_data=overwrite_data,
+        chunk_size=chunk_size,
+    )
+    x_stats = quantile_order_statistics(x, x_counts, x_weights, **source_kw)
+    y_stats = quantile_order_statistics(y, y_counts, y_weights, **source_kw)
+    x_N, y_N = x_stats[0], y_stats[0]
+    if x_N == y_N:
         # If |x| == |y| and the data sets are relatively
         # small, then just plot the matching points.
-        N = min(N, len(x))
-    x = np.sort(x)
-    y = np.sort(y)
+        N = min(N, x_N)
     q = np.linspace(0, 1, N)
-    x_q = np.interp(q, np.linspace(0, 1, len(x)), x)
-    y_q = np.interp(q, np.linspace(0, 1, len(y)), y)
+    x_q = quantiles(*x_stats, q)
+    y_q = quantiles(*y_stats, q)
+    if envelope:
+        x_lower, x_upper = envelope_quantiles(*x_stats, q, **band_kw)
+        y_lower, y_upper = envelope_quantiles(*y_stats, q, **band_kw)
+        envelope = dict(
+            x_lower=x_lower, x_upper=x_upper, y_lower=y_lower, y_upper=y_upper
+        )
     if plot:
+        # Only load the plotting libraries when we plot
+        import matplotlib.pyplot as plt
+
+        if seaborn:
+            import seaborn as sns
+
+            sns.set_theme()
         if ax is None:
             ax = plt.gca()
-        plt.plot(
+        (line,) = plt.plot(
             x_q,
             y_q,
             color=color,
@@ -48,14 +104,107 @@ def qq_plot(
             alpha=alpha,
             label=label,
         )
+        if envelope:
+            # The uncertainty in y's quantiles (vertical) and in x's
+            # (horizontal)
+            fill_kw = dict(alpha=0.2, color=line.get_color())
+            fill_kw.update(envelope_kw or {})
+            ax.fill_between(x_q, envelope["y_lower"], envelope["y_upper"], **fill_kw)
+            ax.fill_betweenx(y_q, envelope["x_lower"], envelope["x_upper"], **fill_kw)
         if outlier_q > 0:
-            low_x_q = np.interp(outlier_q, np.linspace(0, 1, len(x)), x)
-            high_x_q = np.interp(1 - outlier_q, np.linspace(0, 1, len(x)), x)
+            low_x_q, high_x_q = quantiles(*x_stats, limits)
             estimated_extra = outlier_q * (high_x_q - low_x_q) / (1 - 2 * outlier_q)
             ax.set_xlim([low_x_q - estimated_extra, high_x_q + estimated_extra])
 
-            low_y_q = np.interp(outlier_q, np.linspace(0, 1, len(y)), y)
-            high_y_q = np.interp(1 - outlier_q, np.linspace(0, 1, len(y)), y)
+            low_y_q, high_y_q = quantiles(*y_stats, limits)
             estimated_extra = outlier_q * (high_y_q - low_y_q) / (1 - 2 * outlier_q)
             ax.set_ylim([low_y_q - 2 * estimated_extra, high_y_q + 2 * estimated_extra])
+    if envelope:
+        return (x_q, y_q, envelope)
     return (x_q, y_q)
+
+
+def needed_ranks(n, N, limits, band_kw=None):
+    # The order statistics (0-based) needed to interpolate the quantiles
+    # we plot, the axis limits, and (if band_kw is given) the envelopes,
+    # from n data points.  If n <= N, we might plot every point (see
+    # qq_plot()), so we take them all.
+    if n <= N:
+        return np.arange(n)
+    q = np.linspace(0, 1, N)
+    position = np.r_[q, limits] * (n - 1)
+    if band_kw is not None:
+        low, high = envelope_positions(n, q, **band_kw)
+        position = np.r_[position, low, high]
+    ranks = np.r_[np.floor(position), np.ceil(position)]
+    return np.unique(ranks).astype(int)
+
+
+def envelope_positions(n, q, confidence=None, bound=None, use_cache=None):
+    # Our q-th quantile is the order statistic at (0-based) position
+    # q*(n-1), i.e., rank a = q*(n-1) + 1, whose "mode" ECDF value
+    # (a-1)/(n-1) is q.  The CDF band gives an interval [lower(a),
+    # upper(a)] on the true quantile of each rank; inverting it, the true
+    # q-th quantile lies between the ranks where upper(a) = q and where
+    # lower(a) = q.  We evaluate the band once, on a grid of ranks, and
+    # interpolate.
+    if n == 1:
+        return (np.zeros(len(q)), np.zeros(len(q)))
+    a = plot_index_list(n, 4 * len(q)) + 1
+    band_kw = dict(a=a, N=n, confidence=confidence, bound=bound, ecdf_type="mode")
+    if use_cache:
+        lower, upper = get_band_cache().band(**band_kw)
+    else:
+        lower, upper = confidence_band(**band_kw)
+    # The band may be flat where it's clipped to [0, 1]
+    low = np.interp(q, np.maximum.accumulate(upper), a) - 1
+    high = np.interp(q, np.maximum.accumulate(lower), a) - 1
+    return (low, high)
+
+
+def quantile_order_statistics(
+    data, counts, weights, N, limits, band_kw, selection, overwrite_data, chunk_size
+):
+    # Returns (n, ranks, values), where values = sorted(data)[ranks]
+    if counts is not None or weights is not None:
+        values, w, n = clean_weights(data, counts=counts, weights=weights)
+        ranks = needed_ranks(n, N, limits, band_kw)
+        return (n, ranks, weighted_order_statistics(values, w, ranks, n))
+    if isinstance(data, np.memmap) or callable(data):
+        # Read the data a chunk at a time (see chunked.py)
+        chunks = chunk_source(data=data, chunk_size=chunk_size)
+        return chunked_order_statistics(
+            chunks=chunks, index_list=lambda n: needed_ranks(n, N, limits, band_kw)
+        )
+    data, owns_data = clean_data(data)
+    n = len(data)
+    ranks = needed_ranks(n, N, limits, band_kw)
+    values = order_statistics(
+        data, ranks, method=selection, overwrite_data=owns_data or overwrite_data
+    )
+    return (n, ranks, values)
+
+
+def quantiles(n, ranks, values, q):
+    # Linearly interpolated quantiles of n data points, as in
+    # np.interp(q, np.linspace(0, 1, n), sorted_data), given the
+    # order statistics sorted_data[ranks].
+    return interpolate_positions(ranks, values, np.asarray(q) * (n - 1))
+
+
+def envelope_quantiles(n, ranks, values, q, **band_kw):
+    # Confidence intervals on the q-th quantiles; see envelope_positions()
+    low, high = envelope_positions(n, q, **band_kw)
+    return (
+        interpolate_positions(ranks, values, low),
+        interpolate_positions(ranks, values, high),
+    )
+
+
+def interpolate_positions(ranks, values, position):
+    # Interpolate sorted_data at (fractional) positions, given the
+    # order statistics sorted_data[ranks].
+    low = np.floor(position)
+    x_low = values[np.searchsorted(ranks, low)]
+    x_high = values[np.searchsorted(ranks, np.ceil(position))]
+    return x_low + (position - low) * (x_high - x_low)
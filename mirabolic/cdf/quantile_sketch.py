@@ -0,0 +1,144 @@
+# A mergeable quantile sketch, so that we can plot CDFs of data spread
+# across many machines.
+#
+# Each worker builds a sketch of its shard, the sketches are merged, and
+# cdf_plot(data=sketch) plots the CDF, widening the confidence band by
+# the sketch's rank error.  We use the KLL sketch:
+#
+#   Karnin, Lang & Liberty, "Optimal Quantile Approximation in Streams"
+#   https://arxiv.org/abs/1603.05346
+#
+# The sketch keeps a stack of "compactors".  Items on level h stand for
+# 2**h data points.  When a level gets too full, we sort it and promote
+# every other item (starting at a random offset) to the next level up.
+# Each such compaction at level h moves the estimated rank of any value
+# by 0 or +/-2**h, with mean zero, so we can keep track of a
+# (high-probability) bound on the total rank error as we go.
+
+import numpy as np
+
+
+class kll_sketch:
+    def __init__(self, k=200, seed=None):
+        """
+        Sketch a stream of numbers.  Larger "k" uses more memory (about
+        3k values) and gives smaller rank error (roughly 1/k).
+        """
+        assert k >= 2
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.zeros(0)]
+        self.num_compactions = [0]
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """
+        Add an array of values to the sketch.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return self
+        # Make sure no NaNs or Infs...
+        if not np.isfinite(values).all():
+            bad_index = np.min(np.where(~np.isfinite(values)))
+            msg = f"Nonfinite values!  values[{bad_index}] = {values[bad_index]}"
+            raise ValueError(msg)
+
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+        return self
+
+    def merge(self, other):
+        """
+        Fold another sketch (e.g., of a different shard) into this one.
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+            self.num_compactions.append(0)
+        for h in range(len(other.levels)):
+            self.levels[h] = np.concatenate([self.levels[h], other.levels[h]])
+            self.num_compactions[h] += other.num_compactions[h]
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def capacity(self, h):
+        # The top level holds k items, and lower levels hold geometrically
+        # fewer (by a factor of 2/3 per level, as suggested by KLL).
+        depth = len(self.levels) - 1 - h
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def compress(self):
+        while True:
+            full = [
+                h
+                for h in range(len(self.levels))
+                if len(self.levels[h]) > self.capacity(h)
+            ]
+            if len(full) == 0:
+                break
+            h = full[0]
+            if h + 1 == len(self.levels):
+                self.levels.append(np.zeros(0))
+                self.num_compactions.append(0)
+
+            items = np.sort(self.levels[h])
+            # If there's an odd number of items, one stays behind
+            keep = len(items) % 2
+            offset = self.rng.integers(2)
+            promoted = items[keep + offset :: 2]
+            self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            self.levels[h] = items[:keep]
+            self.num_compactions[h] += 1
+
+    def sorted_items(self):
+        # All the items in the sketch, sorted, with their cumulative weights
+        items = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [np.full(len(level), 2**h) for h, level in enumerate(self.levels)]
+        )
+        order = np.argsort(items, kind="stable")
+        return items[order], np.cumsum(weights[order])
+
+    def order_statistics(self, index_list):
+        """
+        Estimate sorted(data)[index_list].  The estimated ranks are off by
+        at most rank_error() (with high probability).
+        """
+        index_list = np.asarray(index_list)
+        items, cumulative_weight = self.sorted_items()
+        x = items[np.searchsorted(cumulative_weight, index_list, side="right")]
+        # We know the extremes exactly
+        x = np.where(index_list == 0, self.min, x)
+        x = np.where(index_list == self.n - 1, self.max, x)
+        return x
+
+    def quantiles(self, q):
+        """
+        Estimate the q-th quantiles, for q in [0, 1].
+        """
+        q = np.asarray(q)
+        index_list = np.round(q * (self.n - 1)).astype(int)
+        return self.order_statistics(index_list)
+
+    def rank_error(self, failure_prob=0.01):
+        """
+        With probability at least 1 - failure_prob, the rank of any single
+        value is estimated to within this fraction of n.
+        """
+        # Each compaction at level h adds an independent, mean-zero error
+        # of at most 2**h, so Hoeffding's inequality bounds the total.
+        if self.n == 0:
+            return 0.0
+        variance = sum(c * 4.0**h for h, c in enumerate(self.num_compactions))
+        return np.sqrt(2 * variance * np.log(2 / failure_prob)) / self.n
+
+    def __len__(self):
+        return self.n
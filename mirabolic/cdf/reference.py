@@ -0,0 +1,92 @@
+# Score new observations against a reference distribution.
+#
+# Given reference data, we want the empirical quantile of each new value
+# x, and a confidence interval on its true quantile F(x).  If x lies
+# between the r-th and (r+1)-th smallest reference values, then
+#
+#   F(X_(r)) <= F(x) <= F(X_(r+1))
+#
+# so F(x) lies within [lower band at rank r, upper band at rank r+1]
+# (taking the lower band at rank 0 to be 0, and the upper band at rank
+# N+1 to be 1).  We sort the data and compute the band once, up front;
+# after that, each query is a binary search and a few table lookups.
+
+import numpy as np
+
+from mirabolic.cdf.cdf_tools import (
+    clean_data,
+    ecdf_value,
+    interpolated_band,
+    ASYMPTOTIC_TOL,
+)
+
+
+class cdf_reference:
+    def __init__(
+        self,
+        data=None,
+        confidence=0.9,
+        bound="marginal_opt",
+        ecdf_type=None,
+        presorted=False,
+        overwrite_data=False,
+        interpolation_tol=1e-8,
+        asymptotic_tol=ASYMPTOTIC_TOL,
+    ):
+        """
+        Build a reference distribution from "data", with a confidence
+        band as in cdf_plot().  The band is computed at every rank, by
+        interpolation (see cdf_tools.interpolated_band()) if N is large.
+        """
+        assert confidence >= 0 and confidence <= 1
+        assert bound in {"marginal_quick", "marginal_opt", "simultaneous", "DKW"}
+        assert ecdf_type in {"classical", "mode", "mean", None}
+
+        data, owns_data = clean_data(data)
+        if not presorted:
+            if not (owns_data or overwrite_data):
+                data = data.copy()
+            data.sort()
+        self.sorted_data = data
+        N = self.N = len(data)
+        self.confidence = confidence
+        self.bound = bound
+
+        a = np.arange(1, N + 1)
+        if N == 1:
+            # As in compute_cdf_band()
+            tail = (1.0 - confidence) / 2
+            lower, upper, error_estimate = np.array([tail]), np.array([1 - tail]), 0.0
+            y = np.array([0.5])
+        else:
+            lower, upper, error_estimate = interpolated_band(
+                N=N,
+                confidence=confidence,
+                bound=bound,
+                ecdf_type=ecdf_type,
+                tol=interpolation_tol,
+                asymptotic_tol=asymptotic_tol,
+            )
+            y = ecdf_value(a=a, N=N, ecdf_type=ecdf_type, bound=bound)
+        self.band_error_estimate = error_estimate
+
+        # Tables indexed by r = number of reference values <= x
+        self.y_table = np.r_[0.0, y]
+        self.lower_table = np.r_[0.0, lower]
+        self.upper_table = np.r_[upper, 1.0]
+
+    def query(self, x):
+        """
+        For each value in "x", return a dict with its rank (the number of
+        reference values <= x), its empirical quantile "y", and the
+        confidence interval [y_lower, y_upper] on its true quantile.
+        """
+        x = np.asarray(x)
+        rank = np.searchsorted(self.sorted_data, x, side="right")
+        return dict(
+            x=x,
+            rank=rank,
+            y=self.y_table[rank],
+            y_lower=self.lower_table[rank],
+            y_upper=self.upper_table[rank],
+        )
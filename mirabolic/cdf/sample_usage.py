@@ -28,10 +28,16 @@ plt.title("Figure 1: Default behavior\n90% Marginal CI")
 
 ################################################################
 # The DKW Inequality gives us a bound that *all* the data points
-# will *simultaneously* fall within the confidence envelope.
+# will *simultaneously* fall within the confidence envelope.  The
+# "simultaneous" bound does the same by widening the marginal band
+# just enough (calibrating by simulation, which takes a moment the
+# first time); it is much tighter than DKW near the ends.
 plt.figure()
 mirabolic.cdf_plot(data=data, bound="DKW", confidence=0.75, color="purple")
-plt.title("Figure 2: Joint bound (DKW)\nProbability all data lies envelope is >=75% ")
+mirabolic.cdf_plot(data=data, bound="simultaneous", confidence=0.75, color="orange")
+plt.title(
+    "Figure 2: Joint bounds (DKW and simultaneous)\nProbability all data lies envelope is >=75% "
+)
 
 
 ##################
@@ -0,0 +1,127 @@
+# Simultaneous confidence bands for CDFs.
+#
+# The marginal bands (see cdf_tools.py) contain each quantile with
+# probability "confidence", but not all of them at once.  The DKW band
+# does contain them all at once, but is very conservative.  Here we
+# widen the marginal_quick band until it has exactly the joint coverage
+# we want, by simulation.
+#
+# For rank a, let p = beta.cdf(u, a, N+1-a) be the probability level
+# of a uniform order statistic u, and m = beta.cdf(mode) as in
+# cdf_CI_marginal_quick().  The marginal_quick interval at level c
+# contains u exactly when
+#
+#   c >= 1 - p/m             (if p < m)
+#   c >= (p - m) / (1 - m)   (otherwise)
+#
+# so each simulated sample needs the band at level (at least) the
+# largest of these over the ranks, and the level we want is the
+# "confidence" quantile of that maximum.  This level depends only on
+# (N, confidence), so we compute it once and keep it.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.stats import beta
+
+from mirabolic.cdf.cdf_tools import confidence_band_with_error
+
+# Most order statistics we track per simulated sample.  Beyond this, we
+# calibrate on a subset of ranks: all those near the ends (where the
+# band is most often breached), and an even spread in between, where
+# neighboring order statistics move almost in lockstep.
+MAX_CALIBRATION_RANKS = 2048
+# Most numbers we simulate at once (per process)
+BATCH_SIZE = 2**22
+# Simulated samples per random stream.  The results only depend on the
+# seed, not on how many processes we use.
+SIMS_PER_TASK = 500
+# Simulated order statistics worth starting a process for (each costs
+# about a microsecond, mostly in beta.cdf)
+MIN_WORK_PER_PROCESS = 2**20
+
+# Calibrated levels, keyed by (N, confidence, num_sims, seed)
+calibrated_levels = {}
+
+
+def calibration_ranks(N):
+    if N <= MAX_CALIBRATION_RANKS:
+        return np.arange(1, N + 1)
+    edge = MAX_CALIBRATION_RANKS // 4
+    middle = np.linspace(edge + 1, N - edge, MAX_CALIBRATION_RANKS // 2)
+    a = np.r_[np.arange(1, edge + 1), middle.round(), np.arange(N - edge + 1, N + 1)]
+    return np.unique(a).astype(int)
+
+
+def required_levels(N, a, num_sims, seed):
+    # For each of num_sims simulated samples of N uniforms, the smallest
+    # marginal_quick level whose band contains the order statistics at
+    # ranks "a".
+    rng = np.random.default_rng(seed)
+    b = N + 1 - a
+    m = beta.cdf((a - 1) / (N - 1), a, b)
+
+    # Uniform order statistics are normalized partial sums of N+1
+    # exponentials; we only need the sums at ranks "a", and the sum of
+    # k exponentials is gamma(k)-distributed.
+    shape = np.diff(np.r_[0, a, N + 1])
+    levels = np.zeros(num_sims)
+    batch = max(1, BATCH_SIZE // len(shape))
+    for start in range(0, num_sims, batch):
+        size = min(batch, num_sims - start)
+        sums = np.cumsum(rng.standard_gamma(shape, size=(size, len(shape))), axis=1)
+        u = sums[:, :-1] / sums[:, -1:]
+        p = beta.cdf(u, a, b)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            need = np.where(p < m, 1 - p / m, (p - m) / (1 - m))
+        levels[start : start + size] = np.nanmax(need, axis=1)
+    return levels
+
+
+def calibrate_simultaneous(N=None, confidence=None, num_sims=4000, seed=0, n_jobs=1):
+    """
+    Find the level at which the marginal_quick band around N data points
+    has joint coverage "confidence", by simulating num_sims samples
+    (spread across n_jobs processes, if n_jobs > 1; n_jobs=None means one
+    per core).  Results are remembered, so each (N, confidence) is only
+    calibrated once, and don't depend on n_jobs.  We only start processes
+    when asked: they need the caller's script to be importable (with an
+    'if __name__ == "__main__"' guard), and can't be started from inside
+    another pool's worker.
+    """
+    assert N >= 2
+    key = (int(N), float(confidence), num_sims, seed)
+    if key in calibrated_levels:
+        return calibrated_levels[key]
+
+    a = calibration_ranks(N)
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    # Give each task its own independent random stream
+    num_tasks = max(1, -(-num_sims // SIMS_PER_TASK))
+    seeds = np.random.SeedSequence(seed).spawn(num_tasks)
+    sims = [len(s) for s in np.array_split(np.arange(num_sims), num_tasks)]
+    # Not worth starting processes for small problems
+    n_jobs = max(1, min(n_jobs, num_tasks, num_sims * len(a) // MIN_WORK_PER_PROCESS))
+    args = ([N] * num_tasks, [a] * num_tasks, sims, seeds)
+    if n_jobs == 1:
+        levels = np.concatenate(list(map(required_levels, *args)))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            levels = np.concatenate(list(pool.map(required_levels, *args)))
+
+    # The "confidence" quantile, rounding up to a simulated level (as
+    # np.quantile(method="higher"), which needs NumPy 1.22)
+    levels.sort()
+    level = float(levels[int(np.ceil(confidence * (len(levels) - 1)))])
+    calibrated_levels[key] = level
+    return level
+
+
+def cdf_band_simultaneous(a=None, N=None, confidence=None, **kwargs):
+    # The marginal_quick band, at the level which gives it joint coverage
+    # "confidence"; see calibrate_simultaneous().
+    level = calibrate_simultaneous(N=N, confidence=confidence)
+    return confidence_band_with_error(
+        **dict(kwargs, a=a, N=N, confidence=level, bound="marginal_quick")
+    )
@@ -0,0 +1,61 @@
+# Unit tests (to be run through "pytest") for "batch.cdf_bands()", which
+# should match calling "cdf_plot()" on each segment separately.
+
+import numpy as np
+import pandas as pd
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.cdf_tools import cdf_plot
+from mirabolic.cdf.batch import cdf_bands
+
+
+def test_matches_cdf_plot():
+    rng = np.random.default_rng(0)
+    sizes = [50, 50, 300, 1, 50]
+    frame = pd.DataFrame(
+        dict(
+            segment=np.repeat(np.arange(len(sizes)), sizes),
+            x=rng.normal(size=sum(sizes)),
+            y=rng.exponential(size=sum(sizes)),
+            label="text",
+        )
+    )
+
+    for by in [None, "segment"]:
+        # By default, we take every numeric column (except "by")
+        columns = ["x", "y"] if by is None else None
+        results = cdf_bands(frame, by=by, columns=columns, max_points=64)
+        if by is None:
+            expected_keys = ["x", "y"]
+        else:
+            expected_keys = [(g, c) for g in range(len(sizes)) for c in ["x", "y"]]
+        assert list(results) == expected_keys
+
+        for key in expected_keys:
+            if by is None:
+                data = frame[key]
+            else:
+                group, column = key
+                data = frame[column][frame["segment"] == group]
+            expected = cdf_plot(data=data, max_points=64, plot_figure=False)
+            for k in ["x", "y", "y_lower", "y_upper", "index_list"]:
+                same = np.array_equal(results[key][k], expected[k], equal_nan=True)
+                assert same, (key, k)
+
+
+def test_independent_results():
+    # Segments of the same size don't share arrays
+    frame = pd.DataFrame(dict(x=np.arange(100.0), y=np.arange(100.0) ** 2))
+    results = cdf_bands(frame, max_points=32)
+    before = {k: v.copy() for k, v in results["y"].items() if isinstance(v, np.ndarray)}
+    for k, v in results["x"].items():
+        if isinstance(v, np.ndarray):
+            v[:] = -1
+    for k, v in before.items():
+        assert np.array_equal(results["y"][k], v), k
@@ -0,0 +1,96 @@
+# Unit tests (to be run through "pytest") for "bootstrap.py".  For
+# independent data, the bootstrap band should be about as wide as the
+# beta band; for dependent data, resampling blocks should widen it.
+
+import numpy as np
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf import bootstrap
+from mirabolic.cdf.bootstrap import bootstrap_cdf_band, bootstrap_qq_band
+from mirabolic.cdf.cdf_tools import cdf_plot
+from mirabolic.cdf.qq_plot import qq_plot
+
+
+def width(results):
+    return (results["y_upper"] - results["y_lower"])[8:-8]
+
+
+def test_bootstrap_cdf_band():
+    rng = np.random.default_rng(0)
+    data = rng.normal(size=2000)
+    beta_band = cdf_plot(data=data, ecdf_type="classical", plot_figure=False)
+    boot = bootstrap_cdf_band(data, num_resamples=400)
+    assert np.allclose(boot["x"], beta_band["x"])
+    assert np.allclose(boot["y"], beta_band["y"])
+    ratio = width(boot) / width(beta_band)
+    assert 0.8 < ratio.mean() < 1.2
+
+    # Each way of resampling independent data agrees, roughly
+    values, counts = np.unique(data.round(1), return_counts=True)
+    for kw in [
+        dict(weights=np.ones(len(data))),
+        dict(block_length=1),
+    ]:
+        other = bootstrap_cdf_band(data, num_resamples=400, **kw)
+        assert abs(width(other).mean() / width(boot).mean() - 1) < 0.1
+    expanded = bootstrap_cdf_band(np.repeat(values, counts), num_resamples=400)
+    counted = bootstrap_cdf_band(values, counts=counts, num_resamples=400)
+    assert np.allclose(expanded["x"], counted["x"])
+    assert abs(width(counted).mean() / width(expanded).mean() - 1) < 0.1
+
+    # Strongly dependent data varies much more than independent data
+    series = np.zeros(len(data))
+    for i in range(1, len(data)):
+        series[i] = 0.9 * series[i - 1] + data[i]
+    naive = bootstrap_cdf_band(series, num_resamples=400)
+    blocks = bootstrap_cdf_band(series, num_resamples=400, block_length=50)
+    assert (width(blocks) / width(naive)).mean() > 2
+
+    # Reproducible
+    again = bootstrap_cdf_band(data, num_resamples=400)
+    assert (again["y_lower"] == boot["y_lower"]).all()
+
+
+def test_bootstrap_qq_band():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=3000)
+    y = rng.exponential(size=5000)
+    x_q, y_q, envelope = bootstrap_qq_band(x, y, num_resamples=400)
+    expected_x, expected_y, beta_envelope = qq_plot(x, y, plot=False, envelope=True)
+    assert np.allclose(x_q, expected_x) and np.allclose(y_q, expected_y)
+    for name, q in [("x", x_q), ("y", y_q)]:
+        lower, upper = envelope[f"{name}_lower"], envelope[f"{name}_upper"]
+        assert (lower <= upper).all()
+        # Close to the beta envelope, away from the extremes
+        boot_width = (upper - lower)[30:-30]
+        beta_width = (beta_envelope[f"{name}_upper"] - beta_envelope[f"{name}_lower"])[
+            30:-30
+        ]
+        assert 0.7 < np.median(boot_width / beta_width) < 1.3
+
+    # Sampling weights
+    _, _, weighted = bootstrap_qq_band(
+        x, y, x_weights=np.ones(len(x)), y_weights=np.ones(len(y)), num_resamples=400
+    )
+    assert np.allclose(weighted["y_lower"][:-5], envelope["y_lower"][:-5], atol=0.05)
+
+
+def test_processes(monkeypatch):
+    # By default, we don't start any processes; with n_jobs > 1, we get
+    # the same resamples from a pool.  (We make even this small problem
+    # worth a pool of processes.)
+    monkeypatch.setattr(bootstrap, "MIN_WORK_PER_PROCESS", 1)
+    data = np.random.default_rng(0).normal(size=500)
+    kw = dict(weights=np.ones(len(data)), num_resamples=300)
+    with monkeypatch.context() as m:
+        m.setattr(bootstrap, "ProcessPoolExecutor", None)
+        expected = bootstrap_cdf_band(data, **kw)
+    results = bootstrap_cdf_band(data, n_jobs=2, **kw)
+    for k in ["y_lower", "y_upper"]:
+        assert np.array_equal(results[k], expected[k])
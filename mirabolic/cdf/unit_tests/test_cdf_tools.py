@@ -7,14 +7,27 @@ import sys
 import os
 import matplotlib.pyplot as plt
 from scipy.stats import beta
+from scipy.optimize import minimize_scalar
 
-# Get parent directory on import path
+# Get the repository root on the import path
 current = os.path.dirname(os.path.realpath(__file__))
-parent = os.path.dirname(current)
-sys.path.append(parent)
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
 
-# Import "cdf_plot" (from parent directory)
-from cdf_tools import cdf_plot
+# Import "cdf_plot" and the band machinery behind it
+from mirabolic.cdf.cdf_tools import (
+    cdf_plot,
+    confidence_band,
+    confidence_band_with_error,
+    confidence_interval_bounds,
+    shortest_beta_interval,
+    order_statistics,
+    BAND_ATOL,
+)
+from mirabolic.cdf.qq_plot import qq_plot
+from mirabolic.cdf.band_cache import band_cache, MAX_DISK_CHUNKS
+from mirabolic.cdf import simultaneous
+from mirabolic.cdf.simultaneous import calibrate_simultaneous, calibrated_levels
 
 
 def wassert(x, warning):
@@ -64,6 +77,301 @@ def test_minimal():
                     vec_assert(r >= 0.0, warning3)
 
 
+def test_vectorized_band():
+    # The array version of the band should agree with the per-point
+    # version for every rank.
+    for N in [2, 3, 15, 200]:
+        a = np.arange(1, N + 1)
+        for bound in ["marginal_quick", "marginal_opt", "DKW"]:
+            for confidence in [0, 0.05, 0.5, 0.95, 1.0]:
+                warning = f"ERROR: N={N}, bound={bound}, conf={confidence}"
+                lower, upper = confidence_band(
+                    a=a, N=N, confidence=confidence, bound=bound, ecdf_type=None
+                )
+                ref = np.array(
+                    [
+                        confidence_interval_bounds(
+                            a=int(i),
+                            N=N,
+                            confidence=confidence,
+                            bound=bound,
+                            ecdf_type=None,
+                        )
+                        for i in a
+                    ]
+                )
+                vec_assert(np.abs(lower - ref[:, 0]) <= BAND_ATOL, warning)
+                vec_assert(np.abs(upper - ref[:, 1]) <= BAND_ATOL, warning)
+
+    # Plotting every point should work (and not take forever)
+    results = cdf_plot(data=np.random.randn(5000), max_points=None, plot_figure=False)
+    assert len(results["x"]) == 5000
+
+
+def test_shortest_interval():
+    # The batched Newton solver should find the shortest interval: check
+    # it against a brute-force search over the lower tail probability.
+    for N in [4, 15, 1000]:
+        a = np.arange(1, N + 1)
+        b = N + 1 - a
+        for confidence in [0.05, 0.5, 0.9, 0.999]:
+            warning = f"ERROR: N={N}, conf={confidence}"
+            lower, upper = shortest_beta_interval(a=a, b=b, confidence=confidence)
+            prob = beta.cdf(upper, a, b) - beta.cdf(lower, a, b)
+            vec_assert(np.isclose(prob, confidence), warning)
+            for i in np.unique(np.linspace(1, N - 2, 5).astype(int)):
+
+                def width(p):
+                    return beta.ppf(p + confidence, a[i], b[i]) - beta.ppf(
+                        p, a[i], b[i]
+                    )
+
+                best = minimize_scalar(
+                    width,
+                    bounds=(0, 1 - confidence),
+                    method="bounded",
+                    options=dict(xatol=1e-12),
+                )
+                wassert(upper[i] - lower[i] <= best.fun + 1e-9, warning + f", a={a[i]}")
+
+
+def test_asymptotic_band():
+    # For large N, the approximate band should be within its own error
+    # estimate of the exact band, and edge ranks should be exact.
+    N = 200_000
+    a = np.unique(np.geomspace(1, N, 400).round())
+    a = np.unique(np.r_[a, N + 1 - a])
+    for bound in ["marginal_quick", "marginal_opt"]:
+        for confidence in [0.5, 0.9, 0.99]:
+            kw = dict(a=a, N=N, confidence=confidence, bound=bound)
+            lower, upper, error = confidence_band_with_error(**kw)
+            exact_lower, exact_upper = confidence_band(asymptotic_tol=None, **kw)
+            warning = f"ERROR MESSAGE: bound={bound}, conf={confidence}"
+            wassert((error > 0).mean() > 0.5, warning)
+            wassert((error[(a < 100) | (a > N - 99)] == 0).all(), warning)
+            vec_assert(np.abs(lower - exact_lower) <= error + BAND_ATOL, warning)
+            vec_assert(np.abs(upper - exact_upper) <= error + BAND_ATOL, warning)
+
+    data = np.random.rand(N)
+    results = cdf_plot(data=data, plot_figure=False, use_cache=False)
+    assert results["band_method"] == "mixed"
+    assert 0 < results["band_error_estimate"] <= 1e-6
+    results = cdf_plot(data=data, plot_figure=False, asymptotic_tol=None)
+    assert results["band_method"] == "exact"
+    assert results["band_error_estimate"] == 0
+
+
+def test_simultaneous_band():
+    # The simultaneous band should contain every order statistic at once
+    # with probability "confidence".
+    N = 40
+    confidence = 0.8
+    a = np.arange(1, N + 1)
+    kw = dict(a=a, N=N, confidence=confidence)
+    lower, upper = confidence_band(bound="simultaneous", **kw)
+    quick_lower, quick_upper = confidence_band(bound="marginal_quick", **kw)
+    DKW_lower, DKW_upper = confidence_band(bound="DKW", **kw)
+    assert (lower <= quick_lower).all() and (upper >= quick_upper).all()
+    # Near the ends, it should be much narrower than the DKW band
+    narrower = upper - lower < DKW_upper - DKW_lower
+    assert narrower[: N // 10].all() and narrower[-N // 10 :].all()
+
+    num_samples = 4000
+    u = np.sort(np.random.rand(num_samples, N), axis=1)
+    coverage = ((lower <= u) & (u <= upper)).all(axis=1).mean()
+    assert abs(coverage - confidence) < 0.03
+
+
+def test_simultaneous_processes(monkeypatch):
+    # The calibrated level depends on the seed, but not on how many
+    # processes simulate it.  (We make even this small problem worth a
+    # pool of processes.)
+    monkeypatch.setattr(simultaneous, "MIN_WORK_PER_PROCESS", 1)
+    kw = dict(N=500, confidence=0.9, num_sims=1200)
+    calibrated_levels.clear()
+    # By default, we don't start any processes
+    with monkeypatch.context() as m:
+        m.setattr(simultaneous, "ProcessPoolExecutor", None)
+        level = calibrate_simultaneous(**kw)
+    calibrated_levels.clear()
+    assert calibrate_simultaneous(n_jobs=3, **kw) == level
+    assert calibrate_simultaneous(seed=1, n_jobs=3, **kw) != level
+    calibrated_levels.clear()
+
+
+def test_weighted():
+    # Values with counts should give the same results as the expanded
+    # data; equal weights should give the same results as no weights.
+    rng = np.random.default_rng(0)
+    values = rng.permutation(np.arange(20) * 0.5)
+    counts = rng.integers(0, 50, size=len(values))
+    expanded = np.repeat(values, counts)
+    for max_points in [32, None]:
+        kw = dict(plot_figure=False, max_points=max_points)
+        expected = cdf_plot(data=expanded, **kw)
+        for results in [
+            cdf_plot(data=values, counts=counts, **kw),
+            cdf_plot(data=expanded, weights=np.full(len(expanded), 0.3), **kw),
+        ]:
+            for k in ["x", "y", "y_lower", "y_upper", "index_list"]:
+                assert np.array_equal(results[k], expected[k]), k
+
+    other = rng.normal(size=500)
+    expected = qq_plot(expanded, other, plot=False)
+    results = qq_plot(values, other, x_counts=counts, plot=False)
+    assert np.allclose(results[0], expected[0]) and (results[1] == expected[1]).all()
+
+    # Unequal weights shrink the effective sample size
+    weights = rng.exponential(size=len(expanded))
+    results = cdf_plot(data=expanded, weights=weights, **kw)
+    assert len(results["index_list"]) < len(expanded)
+
+
+def test_adaptive_placement():
+    # Adaptively placed points should come back in index_list, and
+    # interpolating the band between them should be accurate.
+    N = 20000
+    data = np.random.rand(N)
+    a = np.arange(1, N + 1)
+    for bound in ["marginal_opt", "DKW"]:
+        lower, upper = confidence_band(a=a, N=N, confidence=0.9, bound=bound)
+        results = cdf_plot(
+            data=data,
+            bound=bound,
+            placement="adaptive",
+            placement_tol=1e-5,
+            max_points=200,
+            use_cache=False,
+            plot_figure=False,
+        )
+        index_list = results["index_list"]
+        assert index_list[0] == 0 and index_list[-1] == N - 1
+        assert (np.diff(index_list) > 0).all() and len(index_list) <= 200
+        assert (results["x"] == np.sort(data)[index_list]).all()
+
+        interp_lower = np.interp(a, index_list + 1, results["y_lower"])
+        interp_upper = np.interp(a, index_list + 1, results["y_upper"])
+        wassert(np.abs(interp_lower - lower).max() < 2e-5, f"bound={bound}")
+        wassert(np.abs(interp_upper - upper).max() < 2e-5, f"bound={bound}")
+
+
+def test_interpolated_band():
+    # The interpolated band should be within its error estimate of the
+    # exact band, at every rank.
+    N = 30000
+    data = np.random.rand(N)
+    a = np.arange(1, N + 1)
+    for bound in ["marginal_opt", "marginal_quick"]:
+        lower, upper = confidence_band(
+            a=a, N=N, confidence=0.9, bound=bound, asymptotic_tol=None
+        )
+        results = cdf_plot(
+            data=data,
+            bound=bound,
+            max_points=None,
+            asymptotic_tol=None,
+            interpolation_tol=1e-7,
+            plot_figure=False,
+        )
+        assert results["band_method"] == "interpolated"
+        error = results["band_error_estimate"]
+        wassert(0 < error <= 2e-7, f"bound={bound}, error={error}")
+        assert np.abs(results["y_lower"] - lower).max() <= error
+        assert np.abs(results["y_upper"] - upper).max() <= error
+
+        # With fewer points, we only evaluate the band at their ranks
+        few = cdf_plot(
+            data=data,
+            bound=bound,
+            max_points=100,
+            asymptotic_tol=None,
+            interpolation_tol=1e-7,
+            plot_figure=False,
+        )
+        index_list = few["index_list"]
+        assert np.allclose(few["y_lower"], results["y_lower"][index_list], atol=1e-12)
+        assert np.allclose(few["y_upper"], results["y_upper"][index_list], atol=1e-12)
+
+
+def test_band_cache(tmp_path):
+    # Cached bands should match freshly computed ones, and should
+    # survive a round trip through the on-disk table.
+    N = 300
+    a = np.arange(1, N + 1, 7)
+    kw = dict(N=N, confidence=0.9, bound="marginal_opt", ecdf_type=None)
+    lower, upper = confidence_band(a=a, **kw)
+
+    cache = band_cache(maxsize=2, cache_dir=str(tmp_path))
+    for trial in range(2):
+        cached_lower, cached_upper = cache.band(a=a, **kw)
+        assert (cached_lower == lower).all() and (cached_upper == upper).all()
+    assert cache.hits == 1 and cache.misses == 1
+
+    # A new cache (e.g., in another process) reads the table from disk
+    cache = band_cache(cache_dir=str(tmp_path))
+    cached_lower, cached_upper = cache.band(a=a[::-1], **kw)
+    assert (cached_lower == lower[::-1]).all() and (cached_upper == upper[::-1]).all()
+    assert cache.hits == 1 and cache.misses == 0
+
+    # Prewarming covers what cdf_plot() will ask for...
+    cache.prewarm(N_list=[50, 51], confidence=0.5, max_points=20)
+    hits, misses = cache.hits, cache.misses
+    for n in [50, 51]:
+        kw = dict(confidence=0.5, max_points=20, plot_figure=False)
+        cdf_plot(data=np.random.randn(n), use_cache=cache, **kw)
+    assert cache.misses == misses and cache.hits == hits + 2
+    # ...but not other ranks
+    cache.band(a=np.arange(1, 51), N=50, confidence=0.5, bound="marginal_opt")
+    assert cache.misses == misses + 1
+
+
+def test_band_cache_bounds(tmp_path):
+    # The in-memory cache is bounded in bytes (32 per rank)
+    kw = dict(confidence=0.9, bound="marginal_opt")
+    cache = band_cache(max_bytes=32 * 500)
+    cache.band(a=np.arange(1, 2001), N=2000, **kw)
+    assert len(cache.entries) == 0 and cache.total_bytes == 0
+    for N in [600, 700]:
+        cache.band(a=np.arange(1, N + 1, 2), N=N, **kw)
+    assert [key[0] for key in cache.entries] == [700]
+    assert cache.total_bytes == 32 * 350
+
+    # On disk, each miss only writes its new ranks, until we fold them
+    # into one file
+    N = 500
+    expected_lower, expected_upper = confidence_band(a=np.arange(1, N + 1), N=N, **kw)
+    cache = band_cache(cache_dir=str(tmp_path))
+    for start in range(1, MAX_DISK_CHUNKS + 3):
+        cache.band(a=np.arange(start, start + 20), N=N, **kw)
+        files = os.listdir(tmp_path)
+        if start < MAX_DISK_CHUNKS:
+            assert len(files) == start
+            newest = max(files, key=lambda f: os.path.getmtime(tmp_path / f))
+            with np.load(tmp_path / newest) as blob:
+                assert len(blob["a"]) == (20 if start == 1 else 1)
+    assert len(files) == 3
+    # Another process sees every rank
+    cache = band_cache(cache_dir=str(tmp_path))
+    a = np.arange(1, MAX_DISK_CHUNKS + 22)
+    lower, upper = cache.band(a=a, N=N, **kw)
+    assert cache.hits == 1 and cache.misses == 0
+    assert (lower == expected_lower[a - 1]).all()
+    assert (upper == expected_upper[a - 1]).all()
+
+
+def test_order_statistics():
+    # Selection should agree with sorting, including with ties.
+    for data in [np.random.randn(1000), np.random.randint(0, 5, size=1000)]:
+        original = data.copy()
+        for index_list in [[0], [999], [0, 10, 10, 500, 999], np.arange(0, 1000, 3)]:
+            expected = np.sort(data)[index_list]
+            for method in ["auto", "sort", "select"]:
+                x = order_statistics(data, index_list, method=method)
+                assert (x == expected).all()
+        # We shouldn't touch the original data
+        assert (data == original).all()
+
+
 def test_statistical():
     # Let's check that the statistics work correctly.
 
@@ -0,0 +1,58 @@
+# Unit tests (to be run through "pytest") for "chunked.cdf_plot_chunked()",
+# which should reproduce "cdf_plot()" exactly while reading the data in
+# chunks.
+
+import numpy as np
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.cdf_tools import cdf_plot
+from mirabolic.cdf.chunked import (
+    cdf_plot_chunked,
+    chunk_source,
+    chunked_order_statistics,
+)
+
+
+def test_order_statistics():
+    # Awkward data: heavy ties, huge dynamic range, signed zeros, ints
+    rng = np.random.default_rng(0)
+    data_list = [
+        rng.standard_normal(20000),
+        rng.integers(-5, 5, size=20000),
+        np.exp(50 * rng.standard_normal(20000)),
+        np.r_[np.zeros(5000), rng.standard_normal(100)],
+        rng.standard_normal(1000).astype(np.float32),
+        np.array([-0.0, 0.0, -1e-300, 1e300, -np.finfo(float).max]),
+    ]
+    for data in data_list:
+        index_list = np.linspace(0, len(data) - 1, 50).round().astype(int)
+        expected = np.sort(data)[index_list]
+        for max_buffer in [2**20, 100, 1]:
+            chunks = chunk_source(data=data, chunk_size=777)
+            N, _, x = chunked_order_statistics(
+                chunks=chunks, index_list=index_list, bins=16, max_buffer=max_buffer
+            )
+            assert N == len(data)
+            assert x.dtype == data.dtype
+            assert (x == expected).all()
+
+
+def test_matches_cdf_plot(tmp_path):
+    data = np.random.randn(5000)
+    expected = cdf_plot(data=data, plot_figure=False)
+
+    # A memmap, a list of chunks, and a function returning chunks
+    path = os.path.join(tmp_path, "data.npy")
+    np.save(path, data)
+    memmap = np.load(path, mmap_mode="r")
+    chunk_list = np.array_split(data, 7)
+    for source in [memmap, chunk_list, lambda: iter(chunk_list)]:
+        results = cdf_plot_chunked(data=source, chunk_size=1000, plot_figure=False)
+        for k in ["x", "y", "y_lower", "y_upper", "index_list"]:
+            assert (results[k] == expected[k]).all()
@@ -0,0 +1,53 @@
+# Unit tests (to be run through "pytest") for "compare.compare_distributions()",
+# which should match scipy's KS test, and comparing the bands of
+# "cdf_plot()" by hand.
+
+import numpy as np
+from scipy.stats import ks_2samp
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.cdf_tools import cdf_plot
+from mirabolic.cdf.compare import compare_distributions
+
+
+def test_matches_ks_2samp():
+    rng = np.random.default_rng(0)
+    baseline = rng.normal(size=3000)
+    pairs = {}
+    for i, size in enumerate([1, 7, 50, 500, 2000]):
+        # Ties, and shifts big enough to separate the bands
+        segment = rng.normal(loc=0.1 * i, size=size).round(1)
+        pairs[i] = (segment, baseline)
+    pairs["same"] = (baseline, baseline)
+    results = compare_distributions(pairs, max_points=64)
+    assert results["keys"] == list(pairs)
+
+    for i, (x, y) in enumerate(pairs.values()):
+        expected = ks_2samp(x, y, method="asymp")
+        assert np.isclose(results["statistic"][i], expected.statistic)
+        assert np.isclose(results["pvalue"][i], expected.pvalue)
+    assert results["statistic"][-1] == 0 and results["bands_overlap"][-1]
+
+    # Checking the bands at every point
+    everywhere = compare_distributions(pairs, max_points=0)
+    assert (everywhere["band_separation"] >= results["band_separation"]).all()
+    for i, (x, y) in enumerate(pairs.values()):
+        x_band = cdf_plot(data=x, max_points=0, plot_figure=False)
+        y_band = cdf_plot(data=y, max_points=0, plot_figure=False)
+        z = np.r_[x_band["x"], y_band["x"]]
+        bands = []
+        for band in [x_band, y_band]:
+            r = np.searchsorted(band["x"], z, side="right")
+            lower = np.r_[0, band["y_lower"]][r]
+            upper = np.r_[band["y_upper"], 1][r]
+            bands.append((lower, upper))
+        (x_lower, x_upper), (y_lower, y_upper) = bands
+        gap = np.maximum(x_lower - y_upper, y_lower - x_upper).max()
+        assert np.isclose(max(gap, 0), everywhere["band_separation"][i])
+    assert not results["bands_overlap"][4]
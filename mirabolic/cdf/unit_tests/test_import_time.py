@@ -0,0 +1,50 @@
+# Unit tests (to be run through "pytest") for the cost of "import
+# mirabolic": the CDF tools shouldn't load the plotting, LLM or neural
+# net libraries until they're needed.
+
+import subprocess
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+HEAVY_MODULES = [
+    "matplotlib",
+    "seaborn",
+    "openai",
+    "google.generativeai",
+    "huggingface_hub",
+    "sklearn",
+    "umap",
+    "tensorflow",
+]
+
+# Generous, so as not to be flaky; the CDF tools import in about a second
+# (mostly scipy.stats), versus ten seconds or more with everything.
+MAX_IMPORT_SECONDS = 5
+
+
+def test_import_time():
+    # Run in a fresh interpreter, so nothing is imported already
+    script = f"""
+import sys, time
+start = time.perf_counter()
+import mirabolic
+mirabolic.cdf_plot, mirabolic.qq_plot, mirabolic.rate_comparison
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split("\n")
+    elapsed, loaded = float(output[0]), output[1]
+    assert loaded == ""
+    assert elapsed < MAX_IMPORT_SECONDS
@@ -0,0 +1,42 @@
+# Unit tests (to be run through "pytest") for "incremental.incremental_ecdf",
+# which should match "cdf_plot()" on all the data seen so far.
+
+import numpy as np
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.cdf_tools import cdf_plot
+from mirabolic.cdf.incremental import incremental_ecdf
+
+
+def test_matches_cdf_plot():
+    rng = np.random.default_rng(0)
+    baseline = rng.integers(0, 100, size=5000)
+    ecdf = incremental_ecdf(data=baseline, max_points=64)
+    all_data = baseline
+    for batch_size in [1, 10, 300]:
+        batch = rng.integers(0, 100, size=batch_size)
+        ecdf.update(batch)
+        all_data = np.r_[all_data, batch]
+        assert (ecdf.sorted_data == np.sort(all_data)).all()
+
+        results = ecdf.band()
+        expected = cdf_plot(data=all_data, max_points=64, plot_figure=False)
+        for k in ["x", "y", "y_lower", "y_upper", "index_list"]:
+            assert np.array_equal(results[k], expected[k]), k
+        # Nothing changed, so nothing is recomputed
+        assert ecdf.band() is results
+
+
+def test_mixed_types():
+    # Floats added to integer data keep their values
+    ecdf = incremental_ecdf(data=[1, 2, 3]).update([1.5, 2.7])
+    assert np.array_equal(ecdf.sorted_data, [1, 1.5, 2, 2.7, 3])
+    ecdf.update(np.array([2], dtype=np.int8))
+    assert ecdf.sorted_data.dtype == np.float64
+    assert np.array_equal(ecdf.sorted_data, [1, 1.5, 2, 2, 2.7, 3])
@@ -0,0 +1,71 @@
+# Unit tests (to be run through "pytest") for "qq_plot.qq_plot()", which
+# should match interpolating the fully sorted data, however the data is
+# given.
+
+import numpy as np
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.qq_plot import qq_plot
+
+
+def sorted_quantiles(data, N):
+    # The original (full sort) implementation
+    q = np.linspace(0, 1, N)
+    return np.interp(q, np.linspace(0, 1, len(data)), np.sort(data))
+
+
+def test_matches_full_sort(tmp_path):
+    rng = np.random.default_rng(0)
+    for x_size, y_size in [(5, 5), (200, 200), (1000, 1000), (7, 5000), (20000, 3)]:
+        x = rng.normal(size=x_size)
+        y = rng.exponential(size=y_size).round(2)
+        N = min(300, x_size) if x_size == y_size else 300
+        expected_x, expected_y = sorted_quantiles(x, N), sorted_quantiles(y, N)
+
+        x_q, y_q = qq_plot(x, y, plot=False)
+        assert np.allclose(x_q, expected_x) and np.allclose(y_q, expected_y)
+
+        # Chunked inputs
+        path = str(tmp_path / "x.npy")
+        np.save(path, x)
+        x_memmap = np.load(path, mmap_mode="r")
+
+        def y_chunks():
+            for start in range(0, len(y), 333):
+                yield y[start : start + 333]
+
+        x_q, y_q = qq_plot(x_memmap, y_chunks, plot=False, chunk_size=100)
+        assert np.allclose(x_q, expected_x) and np.allclose(y_q, expected_y)
+
+    # Nothing was reordered
+    assert (x_memmap == x).all()
+
+
+def test_envelope():
+    # The envelopes should bracket the quantiles, and usually cover the
+    # true quantiles
+    from scipy.stats import norm
+
+    rng = np.random.default_rng(1)
+    for size in [50, 5000, 10**6]:
+        x = rng.normal(size=size)
+        y = rng.normal(size=size // 2 + 1)
+        x_q, y_q, envelope = qq_plot(x, y, plot=False, envelope=True)
+        assert (envelope["x_lower"] <= x_q).all() and (x_q <= envelope["x_upper"]).all()
+        assert (envelope["y_lower"] <= y_q).all() and (y_q <= envelope["y_upper"]).all()
+        true_q = norm.ppf(np.linspace(0, 1, len(y_q)))[1:-1]
+        covered = (envelope["y_lower"][1:-1] <= true_q) & (
+            true_q <= envelope["y_upper"][1:-1]
+        )
+        assert covered.mean() > 0.7
+
+        # The cache is only a shortcut
+        _, _, uncached = qq_plot(x, y, plot=False, envelope=True, use_cache=False)
+        for key in envelope:
+            assert np.allclose(envelope[key], uncached[key])
@@ -0,0 +1,52 @@
+# Unit tests (to be run through "pytest") for the mergeable quantile
+# sketch, and for plotting a CDF from one.
+
+import numpy as np
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.cdf_tools import cdf_plot
+from mirabolic.cdf.quantile_sketch import kll_sketch
+
+
+def test_small_data_is_exact():
+    # Until the sketch compacts anything, it knows the data exactly
+    data = np.random.randn(100)
+    sketch = kll_sketch(k=200).update(data)
+    assert sketch.rank_error() == 0
+    index_list = np.arange(100)
+    assert (sketch.order_statistics(index_list) == np.sort(data)).all()
+
+
+def test_merged_rank_error():
+    # Sketch shards separately, merge, and check the rank error bound.
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal(200000)
+    sketches = []
+    for i, shard in enumerate(np.array_split(data, 8)):
+        sketch = kll_sketch(k=100, seed=i)
+        for chunk in np.array_split(shard, 10):
+            sketch.update(chunk)
+        sketches.append(sketch)
+    merged = sketches[0]
+    for sketch in sketches[1:]:
+        merged.merge(sketch)
+    assert merged.n == len(data)
+
+    index_list = np.linspace(0, len(data) - 1, 500).round().astype(int)
+    x = merged.order_statistics(index_list)
+    true_rank = np.searchsorted(np.sort(data), x)
+    rank_error = np.abs(true_rank - index_list).max() / len(data)
+    assert rank_error <= merged.rank_error(failure_prob=1e-6)
+
+    # cdf_plot() widens the band by the sketch's error
+    results = cdf_plot(data=merged, plot_figure=False)
+    exact = cdf_plot(data=data, plot_figure=False)
+    assert results["sketch_rank_error"] > 0
+    assert (results["y_lower"] <= exact["y_lower"]).all()
+    assert (results["y_upper"] >= exact["y_upper"]).all()
@@ -0,0 +1,50 @@
+# Unit tests (to be run through "pytest") for "reference.cdf_reference",
+# which scores new observations against a reference distribution.
+
+import numpy as np
+from scipy.stats import norm
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.cdf.cdf_tools import confidence_band, ecdf_value
+from mirabolic.cdf.reference import cdf_reference
+
+
+def test_query():
+    # Compare against a direct (slow) computation
+    rng = np.random.default_rng(0)
+    for N in [1, 10, 2000]:
+        data = rng.normal(size=N)
+        reference = cdf_reference(data=data)
+        x = np.r_[rng.normal(size=500), data[:50], -10, 10]
+        results = reference.query(x)
+
+        rank = (data[None, :] <= x[:, None]).sum(axis=1)
+        assert (results["rank"] == rank).all()
+        if N == 1:
+            continue
+        a = np.arange(1, N + 1)
+        lower, upper = confidence_band(
+            a=a, N=N, confidence=0.9, bound="marginal_opt", asymptotic_tol=None
+        )
+        y = ecdf_value(a=a, N=N, bound="marginal_opt")
+        inside = rank > 0
+        assert (results["y"][~inside] == 0).all()
+        assert np.allclose(results["y"][inside], y[rank[inside] - 1])
+        assert (results["y_lower"][~inside] == 0).all()
+        assert np.allclose(results["y_lower"][inside], lower[rank[inside] - 1])
+        below = rank < N
+        assert (results["y_upper"][~below] == 1).all()
+        assert np.allclose(results["y_upper"][below], upper[rank[below]])
+
+        # The band should contain the true quantiles (usually)
+        true_quantile = norm.cdf(x)
+        covered = (results["y_lower"] <= true_quantile) & (
+            true_quantile <= results["y_upper"]
+        )
+        assert covered.mean() > 0.8
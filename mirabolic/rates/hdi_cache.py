@@ -0,0 +1,204 @@
+# A cache for the highest density intervals of rate_tools.py.
+#
+# A/B reports see the same (successes, trials, confidence) triples again
+# and again, across refreshes and segments, and each interval costs a
+# small Newton solve.  As with the CDF bands (see cdf/band_cache.py), we
+# keep:
+#
+#  - a table of every interval with at most TABLE_MAX_TRIALS trials,
+#    computed all at once the first time we see each confidence level,
+#  - an in-process LRU cache of up to "maxsize" other intervals, and
+#  - optionally, an on-disk table (one small .npz file per confidence
+#    level), so that the work survives between processes.
+#
+# We count lookups answered by any of these as hits, and the rest (which
+# we compute, all at once) as misses.
+
+import os
+from collections import OrderedDict
+import numpy as np
+
+from mirabolic.rates.rate_tools import highest_density_interval
+
+# Largest number of trials in the small-count table
+TABLE_MAX_TRIALS = 100
+
+
+def pack(successes, trials):
+    # One sortable integer per (successes, trials) pair
+    return (trials.astype(np.int64) << 32) | successes.astype(np.int64)
+
+
+def posterior_interval(successes, trials, confidence):
+    # The interval used by rate_statistics()
+    alpha = successes + 1
+    beta = trials + 1 - alpha
+    return highest_density_interval(alpha, beta, confidence)
+
+
+class hdi_cache:
+    def __init__(self, maxsize=2**16, cache_dir=None):
+        """
+        Cache highest density intervals, keyed by (successes, trials,
+        confidence).  We keep up to "maxsize" intervals in memory (besides
+        the small-count table); if "cache_dir" is given, we also store
+        every interval on disk.
+        """
+        assert maxsize >= 1
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.tables = {}
+        self.stored = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def interval(self, successes=None, trials=None, confidence=None):
+        """
+        Return arrays (low, high) with the highest density interval of the
+        success rate of each experiment, as in rate_statistics().
+        """
+        successes = np.asarray(successes)
+        trials = np.asarray(trials)
+        shape = np.broadcast(successes, trials).shape
+        s = np.broadcast_to(successes, shape).ravel()
+        t = np.broadcast_to(trials, shape).ravel()
+        confidence = float(confidence)
+        if not ((s == np.round(s)).all() and (t == np.round(t)).all()):
+            # Only whole numbers are worth caching
+            self.misses += len(s)
+            return posterior_interval(successes, trials, confidence)
+        s, t = s.astype(np.int64), t.astype(np.int64)
+        assert (0 <= s).all() and (s <= t).all() and (t < 2**32).all()
+        low, high = np.zeros(len(s)), np.zeros(len(s))
+
+        # Small counts
+        small = t <= TABLE_MAX_TRIALS
+        if small.any():
+            table_low, table_high = self.table(confidence)
+            index = t[small] * (t[small] + 1) // 2 + s[small]
+            low[small], high[small] = table_low[index], table_high[index]
+
+        # Recently used
+        missing = []
+        for i in np.flatnonzero(~small):
+            key = (int(s[i]), int(t[i]), confidence)
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                low[i], high[i] = self.entries[key]
+            else:
+                missing.append(i)
+        missing = np.array(missing, dtype=int)
+
+        # Stored on disk
+        if len(missing) > 0 and self.cache_dir is not None:
+            stored = self.get_stored(confidence)
+            packed = pack(s[missing], t[missing])
+            pos = np.searchsorted(stored["key"], packed)
+            found = pos < len(stored["key"])
+            found[found] = stored["key"][pos[found]] == packed[found]
+            i = missing[found]
+            low[i], high[i] = stored["low"][pos[found]], stored["high"][pos[found]]
+            self.add_to_entries(s[i], t[i], confidence, low[i], high[i])
+            missing = missing[~found]
+
+        self.hits += len(s) - len(missing)
+        self.misses += len(missing)
+        if len(missing) > 0:
+            # Compute each distinct interval once
+            packed, first, inverse = np.unique(
+                pack(s[missing], t[missing]), return_index=True, return_inverse=True
+            )
+            new_s, new_t = s[missing][first], t[missing][first]
+            new_low, new_high = posterior_interval(new_s, new_t, confidence)
+            low[missing], high[missing] = new_low[inverse], new_high[inverse]
+            self.add_to_entries(new_s, new_t, confidence, new_low, new_high)
+            if self.cache_dir is not None:
+                self.add_to_stored(confidence, packed, new_low, new_high)
+
+        return low.reshape(shape), high.reshape(shape)
+
+    def clear(self):
+        self.entries.clear()
+        self.tables.clear()
+        self.stored.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def table(self, confidence):
+        # Every interval with at most TABLE_MAX_TRIALS trials, indexed by
+        # trials * (trials + 1) / 2 + successes
+        if confidence not in self.tables:
+            t = np.repeat(
+                np.arange(TABLE_MAX_TRIALS + 1), np.arange(1, TABLE_MAX_TRIALS + 2)
+            )
+            s = np.arange(len(t)) - t * (t + 1) // 2
+            # (Where successes == trials, rate_statistics() has beta == 0,
+            # and the interval is NaN.)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.tables[confidence] = posterior_interval(s, t, confidence)
+        return self.tables[confidence]
+
+    def add_to_entries(self, s, t, confidence, low, high):
+        for key_s, key_t, value in zip(s.tolist(), t.tolist(), zip(low, high)):
+            key = (key_s, key_t, confidence)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get_stored(self, confidence):
+        if confidence not in self.stored:
+            stored = None
+            path = self.path(confidence)
+            if os.path.exists(path):
+                with np.load(path) as blob:
+                    stored = {k: blob[k] for k in ["key", "low", "high"]}
+            if stored is None:
+                empty = np.zeros(0)
+                stored = dict(key=np.zeros(0, dtype=np.int64), low=empty, high=empty)
+            self.stored[confidence] = stored
+        return self.stored[confidence]
+
+    def add_to_stored(self, confidence, packed, low, high):
+        stored = self.get_stored(confidence)
+        key = np.concatenate([stored["key"], packed])
+        order = np.argsort(key, kind="stable")
+        stored = dict(
+            key=key[order],
+            low=np.concatenate([stored["low"], low])[order],
+            high=np.concatenate([stored["high"], high])[order],
+        )
+        self.stored[confidence] = stored
+        # Write to a temporary file first, so that other processes sharing
+        # cache_dir never see a partially written table.
+        path = self.path(confidence)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **stored)
+        os.replace(tmp_path, path)
+
+    def path(self, confidence):
+        return os.path.join(self.cache_dir, f"hdi_{confidence!r}.npz")
+
+
+# The cache used by rate_comparison(use_cache=True)
+default_hdi_cache = None
+
+
+def get_hdi_cache():
+    global default_hdi_cache
+    if default_hdi_cache is None:
+        default_hdi_cache = hdi_cache()
+    return default_hdi_cache
+
+
+def configure_hdi_cache(maxsize=2**16, cache_dir=None):
+    """
+    Replace the cache used by rate_comparison(), e.g., to add an on-disk
+    table shared between processes.
+    """
+    global default_hdi_cache
+    default_hdi_cache = hdi_cache(maxsize=maxsize, cache_dir=cache_dir)
+    return default_hdi_cache
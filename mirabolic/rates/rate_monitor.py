@@ -0,0 +1,235 @@
+# Rate statistics for live A/B experiments.
+#
+# A live experiment sends a stream of (experiment, arm, success) events.
+# Rather than rebuilding the lists of counts and rerunning
+# rate_comparison() on every refresh, we keep the counts (which is all
+# the beta posteriors need) in arrays, one row per experiment, and add
+# each event or batch of events in place.  When asked for statistics, we
+# only recompute the experiments that changed since the last time.
+
+import numpy as np
+
+from mirabolic.rates.rate_tools import (
+    lift_statistics,
+    plot_rate_comparison,
+    rate_statistics,
+)
+
+ARMS = ["A", "B"]
+
+
+class rate_monitor:
+    def __init__(
+        self, confidence=0.9, use_cache=True, lift=False, num_samples=2000, seed=0
+    ):
+        """
+        Keep the success and trial counts of both arms of many experiments,
+        keyed by experiment id.  Add events with update() or add_events(),
+        or counts with add_counts(), and get the results of
+        rate_comparison() (with the same "lift" option) with statistics().
+        """
+        assert confidence > 0 and confidence < 1
+        self.confidence = confidence
+        self.use_cache = use_cache
+        self.lift = lift
+        self.lift_kw = dict(num_samples=num_samples, seed=seed)
+        self.rows = {}  # Experiment id -> row
+        self.ids = []  # Row -> experiment id
+        # Counts, one row per experiment, and one column per arm
+        self.successes = np.zeros((16, 2), dtype=np.int64)
+        self.trials = np.zeros((16, 2), dtype=np.int64)
+        # The statistics so far, and which rows have changed since
+        self.computed = {}
+        self.changed = np.zeros(16, dtype=bool)
+
+    def update(self, experiment_id, arm, success):
+        """
+        Add one event: a trial of "arm" ("A" or "B") in the experiment,
+        which succeeded or not.
+        """
+        assert arm in ARMS
+        row = self.row(experiment_id)
+        column = ARMS.index(arm)
+        self.successes[row, column] += bool(success)
+        self.trials[row, column] += 1
+        self.changed[row] = True
+        return self
+
+    def add_events(self, experiment_ids=None, arms=None, successes=None):
+        """
+        Add a batch of events, given as equal-length sequences of
+        experiment ids, arms ("A" or "B") and successes (booleans).
+        New experiments are added in the order we first see them.
+        """
+        arms = np.asarray(arms)
+        successes = np.asarray(successes, dtype=bool)
+        assert len(arms) == len(successes)
+        is_B = arms == "B"
+        assert (is_B | (arms == "A")).all()
+        rows = self.rows_of(experiment_ids)
+        assert len(rows) == len(arms)
+        # Tally each (row, arm) pair
+        cell = 2 * rows + is_B
+        size = 2 * len(self.ids)
+        self.successes[: len(self.ids)] += np.bincount(
+            cell[successes], minlength=size
+        ).reshape(-1, 2)
+        self.trials[: len(self.ids)] += np.bincount(cell, minlength=size).reshape(-1, 2)
+        self.changed[rows] = True
+        return self
+
+    def add_counts(
+        self,
+        experiment_ids=None,
+        num_successes_A=0,
+        num_trials_A=0,
+        num_successes_B=0,
+        num_trials_B=0,
+    ):
+        """
+        Add counts (e.g., those of the latest batch) to each experiment in
+        "experiment_ids".  The counts may be numbers or sequences.
+        """
+        rows = self.rows_of(experiment_ids)
+        counts = np.broadcast_arrays(
+            rows, num_successes_A, num_trials_A, num_successes_B, num_trials_B
+        )[1:]
+        counts = [np.asarray(c, dtype=np.int64) for c in counts]
+        for column, (successes, trials) in enumerate([counts[:2], counts[2:]]):
+            assert (successes >= 0).all() and (successes <= trials).all()
+            np.add.at(self.successes[:, column], rows, successes)
+            np.add.at(self.trials[:, column], rows, trials)
+        self.changed[rows] = True
+        return self
+
+    def statistics(self):
+        """
+        Return the results of rate_comparison() for every experiment so
+        far, in the order we first saw them (listed in "labels").  An
+        experiment without trials in both arms gets NaN statistics.  (Only
+        experiments that changed are recomputed, so with lift=True, the
+        simulated lift intervals of small counts may differ slightly from
+        those of a single rate_comparison() call.)
+        """
+        n = len(self.ids)
+        if n == 0:
+            raise ValueError("Must have at least 1 experiment!")
+        rows = np.flatnonzero(self.changed[:n])
+        self.changed[:n] = False
+        # Make room for new experiments
+        for key, values in self.computed.items():
+            if len(values) < n:
+                self.computed[key] = np.r_[values, np.full(n - len(values), np.nan)]
+        successes, trials = self.successes[rows], self.trials[rows]
+        ready = (trials >= 1).all(axis=1)
+
+        def store(prefix, statistics):
+            for key, value in statistics.items():
+                values = self.computed.setdefault(prefix + key, np.full(n, np.nan))
+                values[rows] = np.nan
+                values[rows[ready]] = value
+
+        for column, arm in enumerate(ARMS):
+            store(
+                f"{arm}.",
+                rate_statistics(
+                    successes[ready, column],
+                    trials[ready, column],
+                    self.confidence,
+                    use_cache=self.use_cache,
+                ),
+            )
+        if self.lift:
+            store(
+                "lift.",
+                lift_statistics(
+                    successes[ready, 0],
+                    trials[ready, 0],
+                    successes[ready, 1],
+                    trials[ready, 1],
+                    self.confidence,
+                    **self.lift_kw,
+                ),
+            )
+
+        results = dict(num_experiments=n, confidence=self.confidence)
+        for key, values in self.computed.items():
+            group, name = key.split(".")
+            results.setdefault(group, {})[name] = values.tolist()
+        results["labels"] = list(self.ids)
+        return results
+
+    def counts(self):
+        """
+        Return the counts so far, as arrays in the order of "labels" (the
+        arguments of rate_comparison()).
+        """
+        n = len(self.ids)
+        return dict(
+            labels=list(self.ids),
+            num_successes_A=self.successes[:n, 0].copy(),
+            num_trials_A=self.trials[:n, 0].copy(),
+            num_successes_B=self.successes[:n, 1].copy(),
+            num_trials_B=self.trials[:n, 1].copy(),
+        )
+
+    def plot(self, **kwargs):
+        """
+        Plot the current statistics; arguments are passed to
+        plot_rate_comparison().
+        """
+        results = self.statistics()
+        plot_rate_comparison(results, **kwargs)
+        return results
+
+    def row(self, experiment_id):
+        # The row of an experiment, adding it if it's new
+        row = self.rows.get(experiment_id)
+        if row is None:
+            row = len(self.ids)
+            self.rows[experiment_id] = row
+            self.ids.append(experiment_id)
+            if row == len(self.trials):
+                self.grow()
+        return row
+
+    def rows_of(self, experiment_ids):
+        # The rows of many experiments, looking up each distinct id once,
+        # in the order we first see them
+        if hasattr(experiment_ids, "to_numpy"):
+            # A PANDAS series (without importing PANDAS)
+            experiment_ids = experiment_ids.to_numpy()
+        if isinstance(experiment_ids, np.ndarray) and experiment_ids.dtype != object:
+            # Ids of one type: find the distinct ones with NumPy
+            experiment_ids = experiment_ids.ravel()
+            distinct, first, inverse = np.unique(
+                experiment_ids, return_index=True, return_inverse=True
+            )
+            order = np.argsort(first)
+            rows = np.zeros(len(distinct), dtype=np.int64)
+            rows[order] = [self.row(i) for i in distinct[order].tolist()]
+            return rows[inverse.ravel()]
+        # Otherwise, keep each id as it is (so that, e.g., 2 and "2" are
+        # different experiments, and tuples are single ids)
+        if isinstance(experiment_ids, (str, bytes, np.ndarray)) or not hasattr(
+            experiment_ids, "__iter__"
+        ):
+            experiment_ids = np.ravel(experiment_ids).tolist()
+        distinct = {}
+        codes = [distinct.setdefault(i, len(distinct)) for i in experiment_ids]
+        rows = np.array([self.row(i) for i in distinct], dtype=np.int64)
+        return rows[np.array(codes, dtype=np.int64)]
+
+    def grow(self):
+        # Double the capacity, so adding an experiment takes O(1) time on
+        # average
+        size = 2 * len(self.trials)
+        for name in ["successes", "trials"]:
+            old = getattr(self, name)
+            new = np.zeros((size, 2), dtype=np.int64)
+            new[: len(old)] = old
+            setattr(self, name, new)
+        self.changed = np.r_[self.changed, np.zeros(size - len(self.changed), bool)]
+
+    def __len__(self):
+        return len(self.ids)
@@ -1,15 +1,13 @@
+import warnings
 import numpy as np
-import pandas as pd
-from scipy.stats import beta as beta_dist
-from scipy.optimize import minimize_scalar
-import matplotlib.pyplot as plt
-import seaborn as sns
-from matplotlib.patches import Rectangle, Ellipse
+from scipy.special import betainc, betaln, digamma, polygamma
+from scipy.stats import norm
 
-sns.set()
-# If you don't like Seaborn's look, switch back to vanilla
-# graphing aesthetics by running:
-#   sns.reset_orig()
+from mirabolic.cdf.cdf_tools import shortest_beta_interval
+
+# The statistics only need NumPy and SciPy; we load Matplotlib (and
+# Seaborn) only when we plot.  If you don't like Seaborn's look, pass
+# seaborn=False.
 
 
 def num_to_list(x):
@@ -26,28 +24,219 @@ def str_to_series(x, df):
 def highest_density_interval(alpha, beta, prob):
     """
     Find the shortest confidence/credibility interval of the beta(A,B) distribution
-    containing probability "prob"
+    containing probability "prob".  Any of the arguments may be arrays, in which case
+    we solve for all the intervals at once (see cdf_tools.shortest_beta_interval()).
     """
-    dist = beta_dist(alpha, beta)
+    shape = np.broadcast(alpha, beta, prob).shape
+    alpha, beta, prob = [
+        np.broadcast_to(np.asarray(v, dtype=float), shape).ravel()
+        for v in (alpha, beta, prob)
+    ]
+    low_tail, high_tail = np.zeros(alpha.shape), np.zeros(alpha.shape)
+    # Usually there's only one "prob"
+    for p in np.unique(prob):
+        same = prob == p
+        low_tail[same], high_tail[same] = shortest_beta_interval(
+            a=alpha[same], b=beta[same], confidence=p
+        )
+    if shape == ():
+        return low_tail[0], high_tail[0]
+    return low_tail.reshape(shape), high_tail.reshape(shape)
 
-    # Function to find the interval
-    def interval_func(low_tail_prob):
-        low_tail = dist.ppf(low_tail_prob)
-        high_tail_prob = low_tail_prob + prob
-        high_tail = dist.ppf(high_tail_prob)
-        return high_tail - low_tail
 
-    # Find the low tail probability that minimizes the interval width
-    low_tail_prob = minimize_scalar(
-        interval_func, bounds=(0, 1 - prob), method="bounded"
-    ).x
+def rate_statistics(
+    num_successes=None, num_trials=None, confidence=0.9, use_cache=True
+):
+    """
+    For each experiment, the observed success rate, and the standard
+    deviation and highest density interval of the beta distribution
+    beta(successes + 1, trials - successes) of the rate.  Returns a dict
+    of arrays (rate, std_dev, low, high).  Intervals are looked up in the
+    HDI cache (see hdi_cache.py) if use_cache is True (or an hdi_cache).
+    """
+    num_successes = np.asarray(num_successes)
+    num_trials = np.asarray(num_trials)
+    # Beta distribution computations
+    ## Set Beta parameters
+    alpha = num_successes + 1
+    ## Sigh.  The "Beta distribution" has a parameter traditionally called "beta".
+    beta = num_trials + 1 - alpha
+    ## Compute variance and thence standard deviation
+    var = alpha * beta / ((alpha + beta) ** 2 * (alpha + beta + 1))
+    if use_cache:
+        # (Imported here to avoid a circular import.)
+        from mirabolic.rates.hdi_cache import get_hdi_cache
+
+        cache = get_hdi_cache() if use_cache is True else use_cache
+        low, high = cache.interval(num_successes, num_trials, confidence)
+    else:
+        low, high = highest_density_interval(alpha, beta, confidence)
+    return dict(
+        rate=num_successes / num_trials, std_dev=np.sqrt(var), low=low, high=high
+    )
 
-    # Compute the interval
-    low_tail = dist.ppf(low_tail_prob)
-    high_tail_prob = low_tail_prob + prob
-    high_tail = dist.ppf(high_tail_prob)
 
-    return low_tail, high_tail
+# If every beta parameter of both arms is at least LARGE_COUNT, the
+# posteriors are nearly normal: we find P(B > A) by numerical integration
+# (on a grid of QUADRATURE_POINTS points), and the lift interval from a
+# normal approximation to log(pB / pA).  Otherwise, we sum P(B > A)
+# exactly, and simulate the lift.
+LARGE_COUNT = 50
+QUADRATURE_POINTS = 65
+# Most numbers we draw at once, when simulating
+BATCH_SIZE = 2**22
+
+
+def lift_statistics(
+    num_successes_A=None,
+    num_trials_A=None,
+    num_successes_B=None,
+    num_trials_B=None,
+    confidence=0.9,
+    num_samples=2000,  # Draws per experiment, when simulating
+    seed=0,
+):
+    """
+    For each experiment, the posterior probability that arm B's rate
+    beats arm A's, and the lift pB/pA - 1: its expected value, and a
+    central "confidence" interval.  (The posteriors are the beta
+    distributions of rate_statistics().)  Returns a dict of arrays
+    (prob_B_beats_A, expected, low, high).
+    """
+    a_A = np.asarray(num_successes_A, dtype=float) + 1
+    b_A = np.asarray(num_trials_A, dtype=float) + 1 - a_A
+    a_B = np.asarray(num_successes_B, dtype=float) + 1
+    b_B = np.asarray(num_trials_B, dtype=float) + 1 - a_B
+    a_A, b_A, a_B, b_B = [
+        np.atleast_1d(p) for p in np.broadcast_arrays(a_A, b_A, a_B, b_B)
+    ]
+    n = len(a_A)
+
+    # E[pB / pA] = E[pB] E[1 / pA], and E[1 / pA] = (a + b - 1) / (a - 1)
+    with np.errstate(divide="ignore"):
+        expected = a_B / (a_B + b_B) * (a_A + b_A - 1) / (a_A - 1) - 1
+
+    prob = np.full(n, np.nan)
+    low, high = np.full(n, np.nan), np.full(n, np.nan)
+    tail = (1 - confidence) / 2
+    smallest = np.minimum(np.minimum(a_A, b_A), np.minimum(a_B, b_B))
+    # (If successes == trials, the beta distribution above is undefined.)
+    expected[smallest <= 0] = np.nan
+
+    large = np.flatnonzero(smallest >= LARGE_COUNT)
+    if len(large) > 0:
+        params = (a_A[large], b_A[large], a_B[large], b_B[large])
+        prob[large] = integrate_prob_beats(*params)
+        low[large], high[large] = log_normal_lift(*params, tail)
+
+    small = np.flatnonzero((smallest > 0) & (smallest < LARGE_COUNT))
+    if len(small) > 0:
+        params = np.c_[a_A[small], b_A[small], a_B[small], b_B[small]]
+        whole = (params == np.round(params)).all(axis=1)
+        prob[small[whole]] = sum_prob_beats(*params[whole].T)
+        # Simulate each distinct experiment once
+        params, inverse = np.unique(params, axis=0, return_inverse=True)
+        p, lo, hi = simulate_lift(*params.T, tail, num_samples, seed)
+        low[small], high[small] = lo[inverse], hi[inverse]
+        prob[small[~whole]] = p[inverse][~whole]
+    return dict(prob_B_beats_A=prob, expected=expected, low=low, high=high)
+
+
+def integrate_prob_beats(a_A, b_A, a_B, b_B):
+    # P(pB > pA) for pA ~ beta(a_A, b_A) and pB ~ beta(a_B, b_B), as the
+    # integral of pdf_A * sf_B (or, equivalently, of pdf_B * cdf_A).  We
+    # integrate over the narrower of the two (call it N, and the other O),
+    # on an evenly spaced grid within 10 standard deviations of its mean,
+    # where the integrand is smooth and vanishes at both ends.  The CDF of
+    # O along the grid is its value at the start (one incomplete beta
+    # function per experiment) plus the integral of pdf_O from there,
+    # which we accumulate by the trapezoid rule with an end correction.
+    def moments(a, b):
+        mean = a / (a + b)
+        return mean, np.sqrt(mean * (1 - mean) / (a + b + 1))
+
+    mean_A, sd_A = moments(a_A, b_A)
+    mean_B, sd_B = moments(a_B, b_B)
+    over_A = sd_A <= sd_B
+    mean = np.where(over_A, mean_A, mean_B)[:, None]
+    sd = np.where(over_A, sd_A, sd_B)[:, None]
+    lo = np.maximum(mean - 10 * sd, 0)
+    hi = np.minimum(mean + 10 * sd, 1)
+    x = lo + (hi - lo) * np.linspace(0, 1, QUADRATURE_POINTS)
+    h = (hi - lo)[:, 0] / (QUADRATURE_POINTS - 1)
+
+    def pdf(a, b):
+        # The density along the grid, and its derivative
+        a, b = a[:, None], b[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_pdf = (a - 1) * np.log(x) + (b - 1) * np.log1p(-x) - betaln(a, b)
+            density = np.exp(log_pdf)
+            slope = density * ((a - 1) / x - (b - 1) / (1 - x))
+        return density, np.where(density > 0, slope, 0)
+
+    pdf_N = pdf(np.where(over_A, a_A, a_B), np.where(over_A, b_A, b_B))[0]
+    pdf_O, slope_O = pdf(np.where(over_A, a_B, a_A), np.where(over_A, b_B, b_A))
+    trapezoids = (pdf_O[:, 1:] + pdf_O[:, :-1]) / 2
+    partial = np.c_[np.zeros(len(h)), np.cumsum(trapezoids, axis=1)] * h[:, None]
+    partial -= (slope_O - slope_O[:, :1]) * (h**2 / 12)[:, None]
+    cdf_O = betainc(np.where(over_A, a_B, a_A), np.where(over_A, b_B, b_A), lo[:, 0])
+    cdf_O = cdf_O[:, None] + partial
+    # If N is A, we want P(pB > x) = 1 - cdf_B; if N is B, P(pA < x) = cdf_A.
+    # (The grid spacing cancels.)
+    other = np.where(over_A[:, None], 1 - cdf_O, cdf_O)
+    prob = (pdf_N * other).sum(axis=1) / pdf_N.sum(axis=1)
+    return np.clip(prob, 0, 1)
+
+
+def sum_prob_beats(a_A, b_A, a_B, b_B):
+    # P(pB > pA) for whole-number parameters, as a finite sum:
+    #
+    #   P(X > Y) = sum_{i < a} B(c + i, d + b) / ((b + i) B(1 + i, b) B(c, d))
+    #
+    # for X ~ beta(a, b) and Y ~ beta(c, d).  By symmetry (swapping the
+    # arms, or p and 1 - p), we can sum over whichever parameter is
+    # smallest.
+    options = [
+        (a_B, b_B, a_A, b_A, False),  # P(pB > pA)
+        (b_A, a_A, b_B, a_B, False),  # P(1 - pA > 1 - pB)
+        (a_A, b_A, a_B, b_B, True),  # 1 - P(pA > pB)
+        (b_B, a_B, b_A, a_A, True),  # 1 - P(1 - pB > 1 - pA)
+    ]
+    choice = np.argmin([o[0] for o in options], axis=0)
+    a, b, c, d = [np.choose(choice, [o[k] for o in options]) for k in range(4)]
+    i = np.arange(a.max())[None, :]
+    a, b, c, d = a[:, None], b[:, None], c[:, None], d[:, None]
+    terms = betaln(c + i, d + b) - np.log(b + i) - betaln(1 + i, b) - betaln(c, d)
+    total = np.where(i < a, np.exp(terms), 0).sum(axis=1)
+    return np.where(choice >= 2, 1 - total, total)
+
+
+def log_normal_lift(a_A, b_A, a_B, b_B, tail):
+    # For large counts, log(pB) - log(pA) is nearly normal, with mean and
+    # variance from the digamma and trigamma functions
+    mean = digamma(a_B) - digamma(a_B + b_B) - digamma(a_A) + digamma(a_A + b_A)
+    var = polygamma(1, a_B) - polygamma(1, a_B + b_B)
+    var += polygamma(1, a_A) - polygamma(1, a_A + b_A)
+    z = norm.ppf([tail, 1 - tail])
+    return (np.expm1(mean + z[0] * np.sqrt(var)), np.expm1(mean + z[1] * np.sqrt(var)))
+
+
+def simulate_lift(a_A, b_A, a_B, b_B, tail, num_samples, seed):
+    # P(pB > pA) and the central interval of pB/pA - 1, from num_samples
+    # draws of each posterior, for a block of experiments at a time (to
+    # bound memory)
+    rng = np.random.default_rng(seed)
+    n = len(a_A)
+    prob, low, high = np.zeros(n), np.zeros(n), np.zeros(n)
+    batch = max(1, BATCH_SIZE // num_samples)
+    for start in range(0, n, batch):
+        i = slice(start, start + batch)
+        size = (num_samples, len(a_A[i]))
+        p_A = rng.beta(a_A[i], b_A[i], size=size)
+        p_B = rng.beta(a_B[i], b_B[i], size=size)
+        prob[i] = (p_B > p_A).mean(axis=0)
+        low[i], high[i] = np.quantile(p_B / p_A - 1, [tail, 1 - tail], axis=0)
+    return prob, low, high
 
 
 def rate_comparison(
@@ -68,6 +257,13 @@ def rate_comparison(
     xlabel="A arm",
     ylabel="B arm",
     title="Response Rate Correlation",
+    seaborn=True,  # Use Seaborn's look when plotting?
+    use_cache=True,  # Look up intervals in the HDI cache? (Or, which hdi_cache?)
+    view="auto",  # Draw each experiment ("patches"), or their "density"?
+    max_patches=1000,  # For view="auto", most experiments to draw individually
+    lift=False,  # Also report P(B > A) and the lift? (See lift_statistics())
+    num_samples=2000,  # For lift=True and small counts, draws per experiment
+    seed=0,
 ):
     """
     We run a series of A/B experiments.  In each experiment, we run a number of trials of
@@ -76,14 +272,15 @@ def rate_comparison(
     experiments.
 
     This function computes the expected success rate and uncertainty for each experiment
-    and (optionally) plots the results.
+    (and, if lift=True, the probability that B's rate beats A's and the lift of B over A;
+    see lift_statistics()), and (optionally) plots the results.  (For the numbers alone,
+    as arrays, see rate_statistics() and lift_statistics().)
     """
 
     if plot_kwargs is None:
         plot_kwargs = {}
-    if ax is None:
-        ax = plt.gca()
     assert patch_type in ["ellipse", "rectangle"]
+    assert view in ["auto", "patches", "density"]
 
     num_successes = dict(A=num_successes_A, B=num_successes_B)
     num_trials = dict(A=num_trials_A, B=num_trials_B)
@@ -114,8 +311,7 @@ def rate_comparison(
     for arm in arms:
         assert num_experiments == len(num_successes[arm])
         assert num_experiments == len(num_trials[arm])
-        for i in range(num_experiments):
-            assert num_trials[arm][i] >= 1
+        assert (np.asarray(num_trials[arm]) >= 1).all()
     if labels is not None:
         assert num_experiments == len(labels)
 
@@ -128,92 +324,162 @@ def rate_comparison(
 
     results = dict(num_experiments=num_experiments, confidence=confidence)
     for arm in arms:
-        results[arm] = dict(rate=[], std_dev=[], low=[], high=[])
-
-        for i in range(num_experiments):
-            results[arm]["rate"].append(num_successes[arm][i] / num_trials[arm][i])
-            # Beta distribution computations
-            ## Set Beta parameters
-            alpha = num_successes[arm][i] + 1
-            ## Sigh.  The "Beta distribution" has a parameter traditionally called "beta".
-            beta = num_trials[arm][i] + 1 - alpha
-            ## Compute variance and thence standard deviation
-            var = alpha * beta / ((alpha + beta) ** 2 * (alpha + beta + 1))
-            results[arm]["std_dev"].append(np.sqrt(var))
-            lower_bound, upper_bound = highest_density_interval(alpha, beta, confidence)
-            results[arm]["low"].append(lower_bound)
-            results[arm]["high"].append(upper_bound)
+        statistics = rate_statistics(
+            num_successes[arm], num_trials[arm], confidence, use_cache=use_cache
+        )
+        results[arm] = {key: value.tolist() for key, value in statistics.items()}
+    if lift:
+        # (For small counts, this simulates the lift, which costs far more
+        # than the rest, so we only do it when asked.)
+        statistics = lift_statistics(
+            num_successes["A"],
+            num_trials["A"],
+            num_successes["B"],
+            num_trials["B"],
+            confidence,
+            num_samples=num_samples,
+            seed=seed,
+        )
+        results["lift"] = {key: value.tolist() for key, value in statistics.items()}
 
     if plot:
-        # Draw a dotted line along the main diagonal
-        mm, MM = np.inf, -np.inf
-        for rate_A, rate_B in zip(results["A"]["low"], results["B"]["low"]):
-            mm = min(mm, min(rate_A, rate_B))
-        for rate_A, rate_B in zip(results["A"]["high"], results["B"]["high"]):
-            MM = max(MM, max(rate_A, rate_B))
-        ax.plot([mm, MM], [mm, MM], ":", color="black")
+        plot_rate_comparison(
+            results,
+            labels=labels,
+            ax=ax,
+            patch_type=patch_type,
+            patch_alpha=patch_alpha,
+            label_font_size=label_font_size,
+            xlabel=xlabel,
+            ylabel=ylabel,
+            title=title,
+            seaborn=seaborn,
+            view=view,
+            max_patches=max_patches,
+        )
+
+    return results
+
+
+# Beyond this many labels, a legend is unreadable, so we leave it out
+MAX_LEGEND_LABELS = 30
+
+
+def plot_rate_comparison(
+    results,
+    labels=None,
+    ax=None,
+    patch_type="rectangle",
+    patch_alpha=0.3,
+    label_font_size=8,
+    xlabel="A arm",
+    ylabel="B arm",
+    title="Response Rate Correlation",
+    seaborn=True,
+    view="auto",
+    max_patches=1000,
+):
+    """
+    Plot the results of rate_comparison().  Each experiment's intervals
+    are drawn as a rectangle (or ellipse), all in one collection; with
+    more than max_patches experiments (for view="auto"), we draw the
+    density of the estimated rates instead.
+    """
+    # Only load the plotting libraries when we plot
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import EllipseCollection, PolyCollection
+    from matplotlib.colors import to_rgb
 
+    if seaborn:
+        import seaborn as sns
+
+        sns.set_theme()
         color_list = sns.color_palette("deep", 8)
-        legend_proxy, legend_label = [], []
-        for i in range(num_experiments):
-            facecolor = color_list[i % len(color_list)]
-            edgecolor = color_list[i // len(color_list)]
-            x_low, x_high = results["A"]["low"][i], results["A"]["high"][i]
-            y_low, y_high = results["B"]["low"][i], results["B"]["high"][i]
-            width = x_high - x_low
-            height = y_high - y_low
-            if patch_type == "ellipse":
-                center_x = (x_low + x_high) / 2
-                center_y = (y_low + y_high) / 2
-                angle = 0
-                patch = Ellipse(
-                    (center_x, center_y),
-                    width,
-                    height,
-                    edgecolor=edgecolor,
-                    facecolor=facecolor,
-                    alpha=patch_alpha,
-                )
-            elif patch_type == "rectangle":
-                patch = Rectangle(
-                    (x_low, y_low),
-                    width,
-                    height,
-                    edgecolor=edgecolor,
-                    facecolor=facecolor,
-                    alpha=patch_alpha,
-                )
-            else:
-                raise ValueError(f"Unknown path type {patch_type}")
-            ax.add_patch(patch)
-            if labels is not None:
-                legend_proxy.append(
-                    plt.Line2D(
-                        [0],
-                        [0],
-                        linestyle="none",
-                        marker="o",
-                        markerfacecolor=facecolor,
-                        markeredgecolor=edgecolor,
-                        markersize=label_font_size,
-                    )
-                )
-                legend_label.append(labels[i])
-        if labels is not None:
-            plt.legend(legend_proxy, legend_label, prop={"size": label_font_size})
+    else:
+        color_list = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    if ax is None:
+        ax = plt.gca()
 
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.title(title)
-        plt.scatter(
-            results["A"]["rate"], results["B"]["rate"], marker=".", color="black"
+    rate_A, rate_B = np.asarray(results["A"]["rate"]), np.asarray(results["B"]["rate"])
+    x_low, x_high = np.asarray(results["A"]["low"]), np.asarray(results["A"]["high"])
+    y_low, y_high = np.asarray(results["B"]["low"]), np.asarray(results["B"]["high"])
+    num_experiments = len(rate_A)
+    if view == "auto":
+        view = "density" if num_experiments > max_patches else "patches"
+    if labels is not None and (view == "density" or len(labels) > MAX_LEGEND_LABELS):
+        warnings.warn(
+            f"Not drawing a legend for {len(labels)} labels "
+            f"(at most {MAX_LEGEND_LABELS}, and only for view='patches')"
         )
-        ax.set_aspect("equal")
+        labels = None
 
-    return results
+    # Draw a dotted line along the main diagonal
+    mm = np.nanmin(np.r_[x_low, y_low])
+    MM = np.nanmax(np.r_[x_high, y_high])
+    ax.plot([mm, MM], [mm, MM], ":", color="black")
+
+    if view == "density":
+        # Too many experiments to tell apart, so show where they lie
+        hexbin = ax.hexbin(rate_A, rate_B, gridsize=50, mincnt=1, cmap="Blues")
+        plt.colorbar(hexbin, ax=ax, label="Experiments")
+    else:
+        i = np.arange(num_experiments)
+        color_list = np.array([to_rgb(c) for c in color_list])
+        facecolor = color_list[i % len(color_list)]
+        edgecolor = color_list[(i // len(color_list)) % len(color_list)]
+        collection_kw = dict(
+            facecolors=facecolor, edgecolors=edgecolor, alpha=patch_alpha
+        )
+        if patch_type == "ellipse":
+            collection = EllipseCollection(
+                x_high - x_low,
+                y_high - y_low,
+                np.zeros(num_experiments),
+                units="xy",
+                offsets=np.c_[(x_low + x_high) / 2, (y_low + y_high) / 2],
+                offset_transform=ax.transData,
+                **collection_kw,
+            )
+        elif patch_type == "rectangle":
+            corners = np.stack(
+                [
+                    np.c_[x_low, y_low],
+                    np.c_[x_high, y_low],
+                    np.c_[x_high, y_high],
+                    np.c_[x_low, y_high],
+                ],
+                axis=1,
+            )
+            collection = PolyCollection(corners, **collection_kw)
+        else:
+            raise ValueError(f"Unknown path type {patch_type}")
+        ax.add_collection(collection)
+
+        if labels is not None:
+            legend_proxy = [
+                plt.Line2D(
+                    [0],
+                    [0],
+                    linestyle="none",
+                    marker="o",
+                    markerfacecolor=facecolor[k],
+                    markeredgecolor=edgecolor[k],
+                    markersize=label_font_size,
+                )
+                for k in range(num_experiments)
+            ]
+            ax.legend(legend_proxy, list(labels), prop={"size": label_font_size})
+        ax.scatter(rate_A, rate_B, marker=".", color="black")
+
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.set_aspect("equal")
+    return ax
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
 
     # Some synthetic data
     num_experiments = 8
@@ -0,0 +1,57 @@
+# Unit tests (to be run through "pytest") for "hdi_cache.py", which should
+# give the same intervals as computing them directly.
+
+import numpy as np
+import sys
+import os
+import warnings
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.rates.rate_tools import highest_density_interval, rate_statistics
+from mirabolic.rates.hdi_cache import hdi_cache
+
+
+def test_hdi_cache(tmp_path):
+    rng = np.random.default_rng(0)
+    # Small counts (from the table) and large ones, with repeats
+    trials = np.r_[rng.integers(1, 100, 300), rng.integers(100, 10**6, 300)]
+    trials = np.r_[trials, trials[300:350]]
+    successes = rng.binomial(trials - 1, 0.1)
+    expected = rate_statistics(successes, trials, use_cache=False)
+
+    cache = hdi_cache(maxsize=100, cache_dir=str(tmp_path))
+    for refresh in range(2):
+        results = rate_statistics(successes, trials, use_cache=cache)
+        assert np.allclose(results["low"], expected["low"])
+        assert np.allclose(results["high"], expected["high"])
+    # The first time, each large count (even a repeated one) missed; the
+    # second time, everything was cached (in memory or on disk)
+    assert cache.misses == 350
+    assert cache.hits == 2 * len(trials) - 350
+    assert len(cache.entries) == 100
+
+    # Another process finds the intervals on disk
+    cache = hdi_cache(cache_dir=str(tmp_path))
+    low, high = cache.interval(successes[-5:], trials[-5:], 0.9)
+    assert cache.hits == 5 and cache.misses == 0
+    assert np.allclose(low, expected["low"][-5:])
+
+    # Scalars, and whole numbers only
+    low, high = cache.interval(3, 10, 0.9)
+    assert np.isclose(low, highest_density_interval(4, 7, 0.9)[0])
+    low, high = cache.interval(3.5, 10, 0.9)
+    assert np.isclose(high, highest_density_interval(4.5, 6.5, 0.9)[1])
+
+
+def test_all_successes():
+    # When successes == trials, the (large count) intervals are NaN, and
+    # computing them shows no warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        results = rate_statistics([150, 3, 0], [150, 3, 5], use_cache=False)
+    assert np.isnan(results["low"][:2]).all()
+    assert np.isclose(results["high"][2], highest_density_interval(1, 5, 0.9)[1])
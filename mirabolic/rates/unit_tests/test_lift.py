@@ -0,0 +1,84 @@
+# Unit tests (to be run through "pytest") for lift_statistics() in
+# "rate_tools.py", against exact sums and simulation.
+
+import numpy as np
+import sys
+import os
+import time
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.rates.rate_tools import (
+    rate_comparison,
+    lift_statistics,
+    integrate_prob_beats,
+    sum_prob_beats,
+)
+
+
+def test_prob_beats():
+    # The integral (for large counts) agrees with the exact sum
+    rng = np.random.default_rng(0)
+    params = rng.integers(50, 400, size=(500, 4)).astype(float)
+    params[:, 1] *= 30
+    assert np.allclose(
+        integrate_prob_beats(*params.T), sum_prob_beats(*params.T), atol=1e-4
+    )
+
+
+def test_lift_statistics():
+    # Large and small counts, against simulation
+    successes_A = np.array([60, 300, 55, 3, 0, 4])
+    trials_A = np.array([1000, 10000, 100000, 20, 10, 5000])
+    successes_B = np.array([75, 340, 80, 5, 1, 9])
+    trials_B = np.array([1000, 10000, 1000, 20, 10, 5000])
+    results = lift_statistics(successes_A, trials_A, successes_B, trials_B)
+
+    rng = np.random.default_rng(0)
+    size = (400000, len(trials_A))
+    p_A = rng.beta(successes_A + 1, trials_A - successes_A, size=size)
+    p_B = rng.beta(successes_B + 1, trials_B - successes_B, size=size)
+    lift = p_B / p_A - 1
+    assert np.allclose(results["prob_B_beats_A"], (p_B > p_A).mean(axis=0), atol=0.01)
+    # (With no successes in A, the expected lift is infinite.)
+    finite = np.isfinite(results["expected"])
+    assert not finite[4]
+    assert np.allclose(
+        results["expected"][finite], lift.mean(axis=0)[finite], rtol=0.02
+    )
+    for key, q in [("low", 0.05), ("high", 0.95)]:
+        expected = np.quantile(lift, q, axis=0)
+        assert np.allclose(results[key], expected, rtol=0.1, atol=0.02)
+
+    # Undefined posteriors (successes == trials)
+    results = lift_statistics([10], [10], [3], [10])
+    assert np.isnan(results["prob_B_beats_A"][0])
+
+
+def test_lift_is_opt_in():
+    # rate_comparison() only simulates the lift when asked, so many small
+    # experiments stay fast
+    rng = np.random.default_rng(0)
+    trials = rng.integers(5, 100, size=50000)
+    successes_A = rng.binomial(trials, 0.1)
+    successes_B = rng.binomial(trials, 0.12)
+    start = time.perf_counter()
+    results = rate_comparison(successes_A, successes_B, trials, trials, plot=False)
+    assert time.perf_counter() - start < 5
+    assert "lift" not in results
+
+    results = rate_comparison(
+        successes_A[:10],
+        successes_B[:10],
+        trials[:10],
+        trials[:10],
+        plot=False,
+        lift=True,
+    )
+    expected = lift_statistics(
+        successes_A[:10], trials[:10], successes_B[:10], trials[:10]
+    )
+    assert np.allclose(results["lift"]["prob_B_beats_A"], expected["prob_B_beats_A"])
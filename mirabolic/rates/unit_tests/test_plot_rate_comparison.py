@@ -0,0 +1,76 @@
+# Unit tests (to be run through "pytest") for plot_rate_comparison() in
+# "rate_tools.py": each view and patch type should draw without errors.
+
+import numpy as np
+import sys
+import os
+import warnings
+import matplotlib
+import pytest
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.collections import EllipseCollection, PolyCollection
+
+from mirabolic.rates.rate_tools import (
+    rate_comparison,
+    plot_rate_comparison,
+    MAX_LEGEND_LABELS,
+)
+
+
+def experiments(n):
+    rng = np.random.default_rng(0)
+    trials = rng.integers(100, 5000, size=n)
+    successes_A = rng.binomial(trials, 0.03)
+    successes_B = rng.binomial(trials, 0.035)
+    return rate_comparison(successes_A, successes_B, trials, trials, plot=False)
+
+
+def test_patches():
+    results = experiments(10)
+    labels = [f"experiment {i}" for i in range(10)]
+    for patch_type, kind in [
+        ("rectangle", PolyCollection),
+        ("ellipse", EllipseCollection),
+    ]:
+        fig, ax = plt.subplots()
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            plot_rate_comparison(
+                results, labels=labels, ax=ax, patch_type=patch_type, seaborn=False
+            )
+        collections = [c for c in ax.collections if isinstance(c, kind)]
+        assert len(collections) == 1
+        assert len(ax.get_legend().get_texts()) == 10
+        plt.close(fig)
+
+
+def test_density_and_legend_cap():
+    # Above max_patches, we draw the density instead
+    results = experiments(50)
+    fig, ax = plt.subplots()
+    plot_rate_comparison(results, ax=ax, max_patches=20, seaborn=False)
+    # (A hexbin, counting every experiment, with a colorbar)
+    counts = [c.get_array() for c in ax.collections if c.get_array() is not None]
+    assert len(counts) == 1 and counts[0].sum() == 50
+    assert len(fig.axes) == 2
+    assert ax.get_legend() is None
+    plt.close(fig)
+
+    # Too many labels for a legend: we warn, and leave it out
+    labels = [str(i) for i in range(50)]
+    assert len(labels) > MAX_LEGEND_LABELS
+    for view in ["patches", "density"]:
+        fig, ax = plt.subplots()
+        with pytest.warns(UserWarning, match="legend"):
+            plot_rate_comparison(
+                results, labels=labels, ax=ax, view=view, seaborn=False
+            )
+        assert ax.get_legend() is None
+        plt.close(fig)
@@ -0,0 +1,74 @@
+# Unit tests (to be run through "pytest") for "rate_monitor.py", which
+# should give the same statistics as rate_comparison() on the same counts.
+
+import numpy as np
+import sys
+import os
+
+# Get the repository root on the import path
+current = os.path.dirname(os.path.realpath(__file__))
+root = os.path.dirname(os.path.dirname(os.path.dirname(current)))
+sys.path.append(root)
+
+from mirabolic.rates.rate_monitor import rate_monitor
+from mirabolic.rates.rate_tools import rate_comparison
+
+
+def test_rate_monitor():
+    rng = np.random.default_rng(0)
+    n = 200000
+    ids = rng.integers(0, 300, n)
+    arms = np.where(rng.random(n) < 0.5, "A", "B")
+    successes = rng.random(n) < np.where(arms == "A", 0.05, 0.06)
+
+    monitor = rate_monitor(lift=True)
+    for start in range(0, n, 50000):
+        batch = slice(start, start + 50000)
+        monitor.add_events(ids[batch], arms[batch], successes[batch])
+        monitor.statistics()
+    # Single events, and counts, for old and new experiments
+    monitor.update(7, "B", True)
+    monitor.update(1000, "A", False)
+    monitor.add_counts([3, 2000], [10, 20], [100, 200], [15, 25], [100, 200])
+    results = monitor.statistics()
+
+    counts = monitor.counts()
+    labels = counts.pop("labels")
+    assert results["labels"] == labels
+    assert len(monitor) == 302 and results["num_experiments"] == 302
+    assert counts["num_trials_A"].sum() + counts["num_trials_B"].sum() == n + 602
+    # Experiment 1000 has no trials of B yet
+    missing = labels.index(1000)
+    assert np.isnan(results["A"]["rate"][missing])
+    assert np.isnan(results["lift"]["prob_B_beats_A"][missing])
+
+    ready = np.arange(len(labels)) != missing
+    expected = rate_comparison(
+        **{key: value[ready] for key, value in counts.items()}, plot=False, lift=True
+    )
+    for group in ["A", "B", "lift"]:
+        for key, value in expected[group].items():
+            # (The lift intervals of small counts are simulated, with
+            # different draws when recomputed.)
+            tol = dict(rtol=0.1, atol=0.05) if key in ["low", "high"] else {}
+            assert np.allclose(np.array(results[group][key])[ready], value, **tol)
+
+
+def test_experiment_ids():
+    # New experiments are listed in the order we first see them
+    monitor = rate_monitor()
+    monitor.add_events(["zeta", "alpha", "mid", "alpha"], ["A"] * 4, [True] * 4)
+    monitor.add_events(np.array(["omega", "beta", "zeta"]), ["B"] * 3, [False] * 3)
+    assert monitor.counts()["labels"] == ["zeta", "alpha", "mid", "omega", "beta"]
+
+    # Ids keep their types, in single events and batches alike
+    monitor = rate_monitor()
+    monitor.update(2, "A", True)
+    monitor.add_events([2, "2", ("c1", "s1")], ["A", "B", "A"], [True, False, True])
+    monitor.update(("c1", "s1"), "B", False)
+    monitor.add_counts([("c1", "s1"), 2], 1, 10, 2, 20)
+    counts = monitor.counts()
+    assert counts["labels"] == [2, "2", ("c1", "s1")]
+    assert counts["num_trials_A"].tolist() == [12, 0, 11]
+    assert counts["num_successes_A"].tolist() == [3, 0, 2]
+    assert counts["num_trials_B"].tolist() == [20, 1, 21]
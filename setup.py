@@ -23,6 +23,21 @@ with open(os.path.join(this_dir, "README.md")) as fp:
 with open(os.path.join(this_dir, "mirabolic", "version"), mode="r") as fp:
     version = fp.readline().rstrip()
 
+extras_require = {
+    "llm": [
+        "python-dotenv>=1.0.1",
+        "openai>=0.51.0",
+        "google-generativeai>=0.7.2",
+        "huggingface-hub>=0.24.6",
+        "requests>=2.32.3",
+        "scikit-learn>=1.5.2",
+        "umap-learn>=0.5.6",
+    ],
+    "glm": ["tensorflow>=2.4.1"],
+    "parquet": ["pyarrow>=7.0.0"],
+}
+extras_require["all"] = sorted(set(sum(extras_require.values(), [])))
+
 setup(
     name="mirabolic",
     packages=find_namespace_packages(),
@@ -39,21 +54,17 @@ setup(
     include_package_data=True,
     package_data={"": ["version"]},
     keywords=["Statistics", "Machine Learning", "CDF", "Quantiles"],
+    # The CDF and rate tools only need these; each other subsystem's
+    # dependencies are an optional extra, e.g., "pip install mirabolic[llm]"
+    # (or "mirabolic[all]" for everything).
     install_requires=[
-        "tensorflow>=2.4.1",
         "numpy>=1.19.2",
         "scipy>=1.8.0",
         "pandas>=1.0.0",
         "matplotlib>=3.5.1",
         "seaborn>=0.11.2",
-        "python-dotenv>=1.0.1",
-        "openai>=0.51.0",
-        "google-generativeai>=0.7.2",
-        "huggingface-hub>=0.24.6",
-        "requests>=2.32.3",
-        "scikit-learn>=1.5.2",
-        "umap-learn>=0.5.6",
     ],
+    extras_require=extras_require,
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",